@@ -0,0 +1,155 @@
+from psychopy import core, logging
+import asyncio
+
+from routines import Routine
+
+"""
+A Routine whose methods are coroutines, so that other work can be done in the idle time of the frames of the events
+(e.g., saving the data, preloading the stimuli of the next trial, adaptive updates), instead of waiting for the flips.
+
+Background work is given to the routine as coroutines (or functions), and runs as asyncio tasks. After every flip
+(and the key presses), the routine lets them run until the time left before the next flip is what the routine
+itself needs in a frame (the longest recent frame, measured) plus flip_margin. Asyncio cannot interrupt a task,
+so a task should do its work in small steps, with an await (e.g., await asyncio.sleep(0)) between them:
+every step that goes past the time left (also using up flip_margin), so that the flip could be missed, is reported
+(logged as a warning, and kept in overruns).
+
+    async def preload(images):
+        for image in images:
+            image_cache.get_stim(image, size=image_size)
+            await asyncio.sleep(0) # one image per step
+
+    async def session():
+        trial_routine.background(preload(next_images), name='preload')
+        key, rt = await trial_routine.wait_for_keys_or_time_limit(components=[patch_image], ...)
+        await trial_routine.finish() # wait for the background work left
+
+    trial_routine = AsyncRoutine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key)
+    asyncio.run(session())
+"""
+
+class _TimedSteps(object):
+    """Awaits a coroutine, measuring the time of each of its steps (from one await to the next)."""
+    def __init__(self, coroutine, name, on_step):
+        self.coroutine = coroutine
+        self.name = name
+        self.on_step = on_step
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            start = core.getTime()
+            try:
+                if error is None:
+                    future = self.coroutine.send(value)
+                else:
+                    future = self.coroutine.throw(error)
+            except StopIteration as stop:
+                self.on_step(self.name, start, core.getTime())
+                return stop.value
+            self.on_step(self.name, start, core.getTime())
+            try:
+                value, error = (yield future), None
+            except BaseException as e: # e.g., cancelled: given to the coroutine
+                value, error = None, e
+
+async def _call(function):
+    return function()
+
+class AsyncRoutine(Routine):
+    def __init__(self, window, frames_per_second, escape_key, flip_margin=.002, work_decay=.98, **kwargs):
+        """
+        flip_margin: time (in seconds) left free before every flip, in addition to the time the routine needs in a frame
+        work_decay: how fast the measured time needed by the routine in a frame goes down again after a slow frame
+        The other arguments are the same as in Routine.
+        """
+        Routine.__init__(self, window, frames_per_second, escape_key, **kwargs)
+        self.flip_margin = flip_margin
+        self.work_decay = work_decay
+        self.frame_work = 0. # time needed by the routine in a frame (drawing, flip, keys), as the longest recent frame
+        self.background_time = 0. # time given to the background tasks during the events
+        self.overruns = [] # (event label, task name, step duration, time past the deadline) of the steps that threatened a flip
+        self._tasks = set()
+        self._label = None
+        self._flip_end = None
+        self._idle_end = None
+        self._idle_deadline = None
+        self._draw_time = 0.
+
+    def background(self, work, name=None):
+        """
+        Runs work (a coroutine, or a function, called in a single step) as a background task, in the idle time of the frames
+        (and whenever the session awaits something else). Returns the asyncio task.
+        """
+        if name is None:
+            name = getattr(work, '__name__', repr(work))
+        if not asyncio.iscoroutine(work):
+            work = _call(work)
+        task = asyncio.ensure_future(self._run_task(work, name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run_task(self, coroutine, name):
+        return await _TimedSteps(coroutine, name, self._step_done)
+
+    def _step_done(self, name, start, end):
+        if self._idle_deadline is None: # outside of the events
+            return
+        over = end - self._idle_deadline
+        if over <= self.flip_margin: # in time, or only within the margin
+            return
+        self.overruns.append((self._label, name, end - start, over))
+        self._log(logging.WARNING, 'background task %s took %%.1f ms in %s, %%.1f ms past the frame budget' % (
+            name.replace('%', '%%'), str(self._label).replace('%', '%%')), 1000*(end - start), 1000*over)
+
+    async def finish(self):
+        """Waits for all the background tasks to be done, and returns their results."""
+        return await asyncio.gather(*list(self._tasks))
+
+    def _flip(self):
+        flip_start = core.getTime()
+        flip_time = Routine._flip(self)
+        self._flip_end = core.getTime()
+        if self._idle_end is not None: # the drawing of this frame
+            self._draw_time = flip_start - self._idle_end
+        return flip_time
+
+    async def _idle(self):
+        # lets the background tasks run until the time that the routine needs before the next flip
+        now = core.getTime()
+        if self._idle_end is not None:
+            work = now - self._flip_end + self._draw_time # keys after the flip, and drawing before it
+            self.frame_work = max(work, self.work_decay*self.frame_work)
+        self._idle_deadline = self._flip_end + self.frame_period - self.frame_work - self.flip_margin
+        while len(self._tasks) > 0 and core.getTime() < self._idle_deadline:
+            await asyncio.sleep(0)
+        self._idle_deadline = None
+        self._idle_end = core.getTime()
+        self.background_time += self._idle_end - now
+
+    async def _run_frames_async(self, label, frames):
+        self._label = label
+        self._idle_end = None # the first frame of an event is not measured
+        while True:
+            try:
+                next(frames)
+            except StopIteration as stop:
+                self._label = None
+                return stop.value
+            await self._idle()
+
+    async def wait_for_time_limit(self, components, time_seconds, label, **kwargs):
+        return await self._run_frames_async(label, self._wait_for_time_limit(components, time_seconds, label, **kwargs))
+
+    async def wait_for_keys(self, components, valid_keys, label, **kwargs):
+        return await self._run_frames_async(label, self._wait_for_keys(components, valid_keys, label, **kwargs))
+
+    async def wait_for_keys_or_time_limit(self, components, valid_keys, time_seconds, label, **kwargs):
+        return await self._run_frames_async(label, self._wait_for_keys_or_time_limit(components, valid_keys, time_seconds, label, **kwargs))
+
+    async def wait_for_time_limit_first_key(self, components, valid_keys, time_seconds, label, **kwargs):
+        return await self._run_frames_async(label, self._wait_for_time_limit_first_key(components, valid_keys, time_seconds, label, **kwargs))
+
+    async def wait_for_region(self, components, regions, label, **kwargs):
+        return await self._run_frames_async(label, self._wait_for_region(components, regions, label, **kwargs))
@@ -0,0 +1,190 @@
+from __future__ import division
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+import numpy as np
+
+from headless import HeadlessWindow, HeadlessEvents, ScriptedResponder
+from routines import Routine
+
+"""
+Benchmarks the Python overhead of the Routine methods, without waiting for the monitor:
+the window is a HeadlessWindow (flips return immediately) and the components are stubs that do nothing when drawn.
+
+For each method and number of components it reports:
+- us/frame: time per frame, from long events
+- us/call: time spent setting up and closing an event (an event of 1 frame, minus the cost of the frame)
+- blocks/frame: memory blocks allocated by Python in the frames and still allocated at the end of them, per frame (should be 0)
+- peak B/frame: memory allocated within a frame and freed before its end (bytes, mean over the frames; 0 if nothing is allocated)
+Both are traced with tracemalloc, stepping through the frame loop of an event one frame at a time (as AsyncRoutine does).
+CPython does not count the allocations that are freed again, so these are the blocks left behind by the frames
+and the largest memory in use at once within them, which do not include the allocations of the onset and offset.
+It also times the single steps of an event (key list, key polling, drawing, logOnFlip/callOnFlip).
+
+Usage:
+    python benchmark.py --name my_version       # saves results in benchmark_results/my_version.json
+    python benchmark.py --compare benchmark_results/previous.json
+"""
+
+class StubComponent(object):
+    def draw(self):
+        pass
+
+def make_routine(responses=None):
+    window = HeadlessWindow(frames_per_second=60)
+    events = HeadlessEvents(window, ScriptedResponder([] if responses is None else responses))
+    return Routine(window=window, frames_per_second=60, escape_key='escape', timer=window.getClock(), events=events)
+
+def run_method(routine, method, components, time_seconds):
+    if method == 'wait_for_time_limit':
+        routine.wait_for_time_limit(components, time_seconds, 'bench')
+    elif method == 'wait_for_keys':
+        routine.wait_for_keys(components, ['a', 'l'], 'bench')
+    elif method == 'wait_for_keys_or_time_limit':
+        routine.wait_for_keys_or_time_limit(components, ['a', 'l'], time_seconds, 'bench')
+    elif method == 'wait_for_time_limit_first_key':
+        routine.wait_for_time_limit_first_key(components, ['a', 'l'], time_seconds, 'bench')
+
+def method_frames(routine, method, components, time_seconds):
+    # the frame loop of the method, as a generator that yields after every frame
+    if method == 'wait_for_time_limit':
+        return routine._wait_for_time_limit(components, time_seconds, 'bench')
+    elif method == 'wait_for_keys':
+        return routine._wait_for_keys(components, ['a', 'l'], 'bench')
+    elif method == 'wait_for_keys_or_time_limit':
+        return routine._wait_for_keys_or_time_limit(components, ['a', 'l'], time_seconds, 'bench')
+    elif method == 'wait_for_time_limit_first_key':
+        return routine._wait_for_time_limit_first_key(components, ['a', 'l'], time_seconds, 'bench')
+
+METHODS = ['wait_for_time_limit', 'wait_for_keys', 'wait_for_keys_or_time_limit', 'wait_for_time_limit_first_key']
+
+def frame_allocations(routine, method, components, n_frames, time_seconds):
+    """
+    Traces the memory allocated in n_frames frames of an event (after its first frame, before its last one), and returns
+    the number of blocks allocated in them and still allocated after them, and the sum over the frames of the largest
+    memory (in bytes) in use at once within the frame, above the memory in use at its start.
+    """
+    frames = method_frames(routine, method, components, time_seconds)
+    next(frames) # the onset and the first frame
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    peak_bytes = 0
+    for frameN in range(n_frames):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        next(frames)
+        peak_bytes += tracemalloc.get_traced_memory()[1] - current
+    end = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    for _ in frames: # the rest of the event, not traced
+        pass
+
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)] # the snapshots themselves
+    stats = end.filter_traces(ignore).compare_to(start.filter_traces(ignore), 'lineno')
+    return sum(stat.count_diff for stat in stats), peak_bytes
+
+def bench_method(method, n_components, event_seconds=10, n_events=5, n_calls=2000):
+    components = [StubComponent() for c in range(n_components)]
+    n_frames = int(np.round(60*event_seconds))
+
+    # per frame: long events (wait_for_keys ends with a key press at the last frame)
+    routine = make_routine([('a', event_seconds - 1/120)]*(n_events + 1))
+    run_method(routine, method, components, event_seconds) # warm up
+    start = time.perf_counter()
+    for e in range(n_events - 1):
+        run_method(routine, method, components, event_seconds)
+    duration = time.perf_counter() - start
+    us_per_frame = 1e6*duration/((n_events - 1)*n_frames)
+
+    # allocations per frame: traced in the last event (slower), with all the frames but the first and the last one
+    n_traced = n_frames - 2
+    blocks, peak_bytes = frame_allocations(routine, method, components, n_traced, event_seconds)
+
+    # per call: events of 1 frame, minus the cost of the frame
+    routine = make_routine([('a', 0)]*(n_calls + 1))
+    run_method(routine, method, components, 1/60)
+    start = time.perf_counter()
+    for c in range(n_calls):
+        run_method(routine, method, components, 1/60)
+    us_per_call = 1e6*(time.perf_counter() - start)/n_calls - us_per_frame
+
+    return {'method': method, 'n_components': n_components,
+            'us_per_frame': us_per_frame, 'us_per_call': us_per_call,
+            'blocks_per_frame': blocks/n_traced, 'peak_bytes_per_frame': peak_bytes/n_traced}
+
+def bench_steps(n_components_list, number=20000):
+    routine = make_routine()
+    valid_keys = ['a', 'l']
+    steps = {
+        'key_list': lambda: np.append(valid_keys, routine.escape_key),
+        'get_keys': lambda: routine.events.getKeys(keyList=['escape'], timeStamped=routine.timer),
+        'log_and_call_on_flip': lambda: (routine.window.logOnFlip(level=0, msg='bench onset'),
+                                         routine.window.callOnFlip(routine.timer.reset)),
+    }
+    for n_components in n_components_list:
+        components = [StubComponent() for c in range(n_components)]
+        def draw(components=components):
+            for comp in components:
+                comp.draw()
+        steps['draw_%d' % n_components] = draw
+
+    results = {}
+    for name, step in steps.items():
+        routine.window._to_log = []
+        routine.window._to_call = []
+        results[name] = 1e6*min(timeit.repeat(step, number=number, repeat=3))/number
+        routine.window._to_log = []
+        routine.window._to_call = []
+    return results
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the Routine per-frame overhead.')
+    parser.add_argument('--name', default=None, help='name of the results file (default: git version)')
+    parser.add_argument('--output', default='benchmark_results', help='folder where the results are saved')
+    parser.add_argument('--compare', default=None, help='results file to compare with')
+    parser.add_argument('--components', default='1,10,100', help='numbers of components to test')
+    args = parser.parse_args()
+
+    n_components_list = [int(n) for n in args.components.split(',')]
+    version = git_version()
+    results = {'version': version, 'python': sys.version.split()[0], 'numpy': np.__version__,
+               'methods': [bench_method(m, n) for m in METHODS for n in n_components_list],
+               'steps_us': bench_steps(n_components_list)}
+
+    previous = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = {(r['method'], r['n_components']): r for r in json.load(f)['methods']}
+
+    print('%-32s %6s %12s %12s %14s %14s' % ('method', 'comps', 'us/frame', 'us/call', 'blocks/frame', 'peak B/frame'))
+    for r in results['methods']:
+        line = '%-32s %6d %12.2f %12.2f %14.3f %14.1f' % (r['method'], r['n_components'], r['us_per_frame'], r['us_per_call'],
+                                                          r['blocks_per_frame'], r['peak_bytes_per_frame'])
+        if previous is not None and (r['method'], r['n_components']) in previous:
+            before = previous[(r['method'], r['n_components'])]['us_per_frame']
+            line += '   %+.1f%% us/frame' % (100*(r['us_per_frame'] - before)/before)
+        print(line)
+    print()
+    for name, us in results['steps_us'].items():
+        print('%-32s %12.3f us' % (name, us))
+
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    file_name = os.path.join(args.output, '%s.json' % (version if args.name is None else args.name))
+    with open(file_name, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('\nresults saved in %s' % file_name)
+
+if __name__ == '__main__':
+    main()
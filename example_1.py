@@ -1,11 +1,17 @@
 from __future__ import division
+import os
+import sys
+run_headless = '--headless' in sys.argv # python example_1.py --headless: no display, dialog or keyboard (see headless.py)
+if run_headless:
+    os.environ['PYGLET_HEADLESS'] = '1' # set before psychopy is imported: the stimuli are drawn offscreen
 from psychopy.visual import TextStim, Window
-from psychopy import core, event, gui, data, logging
+from psychopy import core, gui, data, logging
 import numpy as np
-import pandas as pd
-import os
 
 from routines import Routine
+from headless import headless_routine, RandomResponder
+from trial_writer import TrialWriter
+from text_pool import TextPool
 
 # Code for the choice experiment of Kusev et al (2009) https://doi.org/10.1037/a0017039
 
@@ -27,21 +33,24 @@ text_color = 'black'
 options_x_offset = 200
 
 #store info about the experiment session
-dlg = gui.Dlg(title=expName)
-dlg.addField('Participant:', 1)
-dlg.addField('Age:', 25)
-dlg.addField('Gender:', choices=['female', 'male', 'prefer not to disclose'])
-dlg.addField('Handedness:', choices=['right', 'left', 'both'])
-dlg.show()
-
-expInfo = dict(zip(['participant', 'age', 'gender', 'hand'], dlg.data))
+if run_headless: # no dialog: the default values
+    expInfo = {'participant': 1, 'age': 25, 'gender': 'prefer not to disclose', 'hand': 'right'}
+else:
+    dlg = gui.Dlg(title=expName)
+    dlg.addField('Participant:', 1)
+    dlg.addField('Age:', 25)
+    dlg.addField('Gender:', choices=['female', 'male', 'prefer not to disclose'])
+    dlg.addField('Handedness:', choices=['right', 'left', 'both'])
+    dlg.show()
+    expInfo = dict(zip(['participant', 'age', 'gender', 'hand'], dlg.data))
+    if not dlg.OK:  # then the user pressed cancel
+        print(expInfo)
+        core.quit()
+
 expInfo['date'] = data.getDateStr()  # add a simple timestamp
 expInfo['expName'] = expName # add the experiment name
-if dlg.OK:  # then the user pressed OK
-    print(expInfo)
-else:
-    print(expInfo)
-    core.quit()
+print(expInfo)
+start_time = core.getTime() # for the startup time reported by the warm-up
 
 #check if data folder exists
 directory=os.path.join(os.getcwd(), 'data')
@@ -60,23 +69,30 @@ mywin = Window(screen_size, units='pix', color=background_color, fullscr=full_sc
 
 #create some stimuli
 fixed_gamble = TextStim(win=mywin, text='50% chance of winning CHF 600', color=text_color, pos=(-options_x_offset, 0))
-changing_gamble = TextStim(win=mywin, color=text_color, pos=(options_x_offset, 0))
-
 fixation_cross = TextStim(win=mywin, text='+', color=text_color)
 
 rewards = np.arange(0, 601, 30)
 rewards[0] += 1
 n_trials = len(rewards)
 
-#create the dataframe
-data = pd.DataFrame([])
+changing_gambles = TextPool(window=mywin, texts=['a sure gain of  CHF %s' % r for r in rewards], color=text_color, pos=(options_x_offset, 0)) # one stimulus per trial
+
+#create the file where the data are saved trial by trial
+trial_writer = TrialWriter(fileName + '.csv', constants=expInfo)
 
 #draw the stimuli
-trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key)
+if run_headless: # virtual clock (faster than real time) and random responses
+    trial_routine = headless_routine(frames_per_second, escape_key, RandomResponder(seed=expInfo['participant']))
+else:
+    trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key)
+# draw everything once before the first trial
+trial_routine.warm_up(
+        components=[fixed_gamble, fixation_cross, changing_gambles],
+        start_time=start_time)
 
 for t in range(n_trials):
     # put here things that change every trial
-    changing_gamble.text = 'a sure gain of  CHF %s' % rewards[t]
+    changing_gamble = changing_gambles[t]
 
     # first event
     trial_routine.wait_for_time_limit(
@@ -90,13 +106,10 @@ for t in range(n_trials):
         valid_keys=choice_keys, 
         time_seconds=choice_time_limit, 
         label='gamble_choice')
-    data = data.append({'rt':rt, 'choice': key, 'trial': t, 'reward': rewards[t]}, ignore_index=True) # record the responses
+    trial_writer.write({'rt':rt, 'choice': key, 'trial': t, 'reward': rewards[t]}) # record the responses
 
-    #save data to file
-    for label in expInfo.keys():
-        data[label] = expInfo[label]
-    data.to_csv(fileName + '.csv')
     
 #cleanup
+trial_writer.close()
 mywin.close()
 core.quit()
@@ -1,11 +1,18 @@
 from __future__ import division
+import os
+import sys
+run_headless = '--headless' in sys.argv # python example_2.py --headless: no display, dialog or keyboard (see headless.py)
+if run_headless:
+    os.environ['PYGLET_HEADLESS'] = '1' # set before psychopy is imported: the stimuli are drawn offscreen
 from psychopy.visual import TextStim, Window
-from psychopy import core, event, gui, data, logging
+from psychopy import core, gui, data, logging
 import numpy as np
-import pandas as pd
-import os
 
 from routines import Routine
+from headless import headless_routine, RandomResponder
+from trial_writer import TrialWriter
+from text_pool import TextPool
+from journal import Journal
 
 # Code for the choice titration experiment of Weber and Chapman (2005) https://doi.org/10.1016/j.obhdp.2005.01.001
 
@@ -27,21 +34,24 @@ options_x_offset = 200
 text_height = 20
 
 #store info about the experiment session
-dlg = gui.Dlg(title=expName)
-dlg.addField('Participant:', 1)
-dlg.addField('Age:', 25)
-dlg.addField('Gender:', choices=['female', 'male', 'prefer not to disclose'])
-dlg.addField('Handedness:', choices=['right', 'left', 'both'])
-dlg.show()
-
-expInfo = dict(zip(['participant', 'age', 'gender', 'hand'], dlg.data))
+if run_headless: # no dialog: the default values
+    expInfo = {'participant': 1, 'age': 25, 'gender': 'prefer not to disclose', 'hand': 'right'}
+else:
+    dlg = gui.Dlg(title=expName)
+    dlg.addField('Participant:', 1)
+    dlg.addField('Age:', 25)
+    dlg.addField('Gender:', choices=['female', 'male', 'prefer not to disclose'])
+    dlg.addField('Handedness:', choices=['right', 'left', 'both'])
+    dlg.show()
+    expInfo = dict(zip(['participant', 'age', 'gender', 'hand'], dlg.data))
+    if not dlg.OK:  # then the user pressed cancel
+        print(expInfo)
+        core.quit()
+
 expInfo['date'] = data.getDateStr()  # add a simple timestamp
 expInfo['expName'] = expName # add the experiment name
-if dlg.OK:  # then the user pressed OK
-    print(expInfo)
-else:
-    print(expInfo)
-    core.quit()
+print(expInfo)
+start_time = core.getTime() # for the startup time reported by the warm-up
 
 #check if data folder exists
 directory=os.path.join(os.getcwd(), 'data')
@@ -59,24 +69,54 @@ logging.console.setLevel(logging.WARNING)  # this outputs to the screen, not a f
 mywin = Window(screen_size, units='pix', color=background_color, fullscr=full_screen)
 
 #create some stimuli
-safe_gamble = TextStim(win=mywin, color=text_color, pos=(-options_x_offset, 0), height=text_height)
 risky_gamble = TextStim(win=mywin, text="10% chance of CHF 3000", color=text_color, pos=(options_x_offset, 0), height=text_height)
 
 n_trials = 50 # max number of trials...
 value_current = 1500
 value_upper = 3000
 value_lower = 0
-
-#create the dataframe
-data = pd.DataFrame([])
+min_difference = 25
+
+def titration_values(lower, upper):
+    # all the values that can be shown during the titration, starting from the [lower, upper] range
+    current = int(np.round(np.mean([upper, lower])))
+    values = [current]
+    if (current-lower) >= min_difference:
+        values += titration_values(lower, current)
+    if (upper-current) >= min_difference:
+        values += titration_values(current, upper)
+    return values
+
+safe_gambles = TextPool(window=mywin, texts=["100% chance of CHF {}".format(v) for v in set(titration_values(value_lower, value_upper))],
+                        color=text_color, pos=(-options_x_offset, 0), height=text_height)
+
+#create the file where the data are saved trial by trial
+trial_writer = TrialWriter(fileName + '.csv', constants=expInfo)
+
+#resume the titration from the last completed trial if the previous session of this participant was interrupted
+journal = Journal(os.path.join('data', '%s_%s_journal.npy' % (expName, expInfo['participant'])), fields=['value_upper', 'value_lower'])
+last_trial = journal.last()
+first_trial = 0
+if last_trial is not None:
+    first_trial = last_trial['trial'] + 1
+    value_upper = int(last_trial['value_upper'])
+    value_lower = int(last_trial['value_lower'])
+    print('resuming from trial %d' % first_trial)
 
 #draw the stimuli
-trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key)
+if run_headless: # virtual clock (faster than real time) and random responses
+    trial_routine = headless_routine(frames_per_second, escape_key, RandomResponder(seed=expInfo['participant']))
+else:
+    trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key)
+# draw everything once before the first trial
+trial_routine.warm_up(
+        components=[risky_gamble, safe_gambles],
+        start_time=start_time)
 
-for t in range(n_trials):
+for t in range(first_trial, n_trials):
     # put here things that change at the beginning of every trial
     value_current = int(np.round(np.mean([value_upper, value_lower])))
-    safe_gamble.text = "100% chance of CHF {}".format(value_current)
+    safe_gamble = safe_gambles.get("100% chance of CHF {}".format(value_current))
 
     # first event
     trial_routine.wait_for_time_limit(
@@ -89,25 +129,23 @@ for t in range(n_trials):
         components=[safe_gamble, risky_gamble],
         valid_keys=choice_keys,
         label='gamble_choice')
-    data = data.append(
-        {'rt':rt, 'choice': key, 'trial': t, 'current': value_current, 'upper': value_upper, 'lower': value_lower, 'difference':value_upper-value_lower}, 
-        ignore_index=True) # record the responses
-
-    #save data to file
-    for label in expInfo.keys():
-        data[label] = expInfo[label]
-    data.to_csv(fileName + '.csv')
-    
+    trial_writer.write(
+        {'rt':rt, 'choice': key, 'trial': t, 'current': value_current, 'upper': value_upper, 'lower': value_lower, 'difference':value_upper-value_lower}) # record the responses
+
     # put here things that change at the end of every trial
     if key == choice_keys[0]:
         value_upper = value_current
     elif key == choice_keys[1]:
         value_lower = value_current
-    
+    journal.record(t, value_upper=value_upper, value_lower=value_lower)
+
     # stop experiment when:
-    if (value_upper-value_lower) < 25:
+    if (value_upper-value_lower) < min_difference:
         break
 
 #cleanup
+journal.finish()
+journal.close()
+trial_writer.close()
 mywin.close()
 core.quit()
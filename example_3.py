@@ -1,11 +1,21 @@
 from __future__ import division
-from psychopy.visual import TextStim, ImageStim, Window
-from psychopy import core, event, gui, data, logging
+import os
+import sys
+run_headless = '--headless' in sys.argv # python example_3.py --headless: no display, dialog or keyboard (see headless.py)
+if run_headless:
+    os.environ['PYGLET_HEADLESS'] = '1' # set before psychopy is imported: the stimuli are drawn offscreen
+from psychopy.visual import TextStim, Window
+from psychopy import core, gui, data, logging
 import numpy as np
 import pandas as pd
-import os
 
 from routines import Routine
+from headless import headless_routine, RandomResponder
+from trial_writer import TrialWriter
+from trial_table import TrialTable
+from image_cache import ImageCache
+from sequences import shuffled_orders, load_schedule
+from patches import generate_patches, PATCH_CACHE
 
 # Code for the feedback experiment of Spiering & Ashby (2008) https://doi.org/10.1111/j.1467-9280.2008.02219.x
 
@@ -26,6 +36,7 @@ message_beginning_duration = 5
 
 #stimuli settings
 image_size = 100
+generated_patches = False # True: a new set of patches for every participant (see patches.py), instead of the ones in stimuli/example_3
 text_correct_color = 'blue'
 text_incorrect_color = 'red'
 text_too_slow = 'black'
@@ -33,21 +44,24 @@ text_beginning_block = 'black'
 text_height = 20
 
 #store info about the experiment session
-dlg = gui.Dlg(title=expName)
-dlg.addField('Participant:', 1)
-dlg.addField('Age:', 25)
-dlg.addField('Gender:', choices=['female', 'male', 'prefer not to disclose'])
-dlg.addField('Handedness:', choices=['right', 'left', 'both'])
-dlg.show()
-
-expInfo = dict(zip(['participant', 'age', 'gender', 'hand'], dlg.data))
+if run_headless: # no dialog: the default values
+    expInfo = {'participant': 1, 'age': 25, 'gender': 'prefer not to disclose', 'hand': 'right'}
+else:
+    dlg = gui.Dlg(title=expName)
+    dlg.addField('Participant:', 1)
+    dlg.addField('Age:', 25)
+    dlg.addField('Gender:', choices=['female', 'male', 'prefer not to disclose'])
+    dlg.addField('Handedness:', choices=['right', 'left', 'both'])
+    dlg.show()
+    expInfo = dict(zip(['participant', 'age', 'gender', 'hand'], dlg.data))
+    if not dlg.OK:  # then the user pressed cancel
+        print(expInfo)
+        core.quit()
+
 expInfo['date'] = data.getDateStr()  # add a simple timestamp
 expInfo['expName'] = expName # add the experiment name
-if dlg.OK:  # then the user pressed OK
-    print(expInfo)
-else:
-    print(expInfo)
-    core.quit()
+print(expInfo)
+start_time = core.getTime() # for the startup time reported by the warm-up
 
 #check if data folder exists
 directory=os.path.join(os.getcwd(), 'data')
@@ -72,7 +86,7 @@ both leanring block and transfer are 30 trials, so 60 trials in total
 """
 
 directory_stimuli = os.path.join(os.getcwd(), 'stimuli', 'example_3') # directory where images can be found
-patch_image = ImageStim(win=mywin,  size=image_size) # create image object
+image_cache = ImageCache(window=mywin) # the images are read from disk only once, and then reused
 n_trials = 30
 
 if (expInfo['participant'] % 2) == 0: # order difficulty even participants
@@ -88,20 +102,34 @@ create a dataframe with information about the stimuli corrisponding to their fil
 
 example: image 1 (patch1.png) is from category A, so the correct response is 'a' and the difficulty is easy
 """
-stimuli = pd.DataFrame(
-    {'image_number': range(1, 31),
-     'category': np.repeat(['A', 'B'], repeats=15),
-     'correct_response': np.repeat(choice_keys, repeats=15),
-     'difficulty': pd.Categorical(np.tile(np.repeat(['easy', 'medium', 'hard'], repeats=5), 2), categories=order_difficulty), # make it a categorical object to order it
-    })
+if generated_patches: # the same table, generated (or taken from the cache) with the images
+    stimuli = generate_patches(n_per_level=5, correct_responses=choice_keys, image_size=image_size, seed=expInfo['participant'])
+    stimuli['difficulty'] = pd.Categorical(stimuli['difficulty'], categories=order_difficulty) # make it a categorical object to order it
+    directory_stimuli = os.path.join(os.getcwd(), PATCH_CACHE)
+else:
+    stimuli = pd.DataFrame(
+        {'image_number': range(1, 31),
+         'image': ['patch{}.png'.format(n) for n in range(1, 31)],
+         'category': np.repeat(['A', 'B'], repeats=15),
+         'correct_response': np.repeat(choice_keys, repeats=15),
+         'difficulty': pd.Categorical(np.tile(np.repeat(['easy', 'medium', 'hard'], repeats=5), 2), categories=order_difficulty), # make it a categorical object to order it
+        })
 print(stimuli)
 
 n_blocks = 2
-transfer_block = stimuli.sample(frac=1).reset_index(drop=True) # shuffle stimuli across difficulty levels
-learning_block = stimuli.groupby(['difficulty']).apply(lambda x: x.sample(frac=1)).reset_index(drop=True) # shuffle stimuli by difficulty level
+schedule_file = os.path.join(os.getcwd(), 'stimuli', 'example_3_schedule.npy') # orders generated in advance for all participants, if any
+if os.path.exists(schedule_file):
+    learning_order, transfer_order = load_schedule(schedule_file, expInfo['participant'])
+else:
+    learning_order = shuffled_orders(1, n_trials, group_ranks=stimuli['difficulty'].cat.codes.values)[0] # shuffle stimuli by difficulty level
+    transfer_order = shuffled_orders(1, n_trials)[0] # shuffle stimuli across difficulty levels
+transfer_block = stimuli.iloc[transfer_order].reset_index(drop=True)
+learning_block = stimuli.iloc[learning_order].reset_index(drop=True)
 blocks = [learning_block, transfer_block] # blocks order
 print(learning_block)
 
+image_cache.preload([os.path.join(directory_stimuli, image) for image in stimuli['image']], size=image_size, pos=(0, 0))
+
 correct_message = TextStim(win=mywin, text="Correct!", color=text_correct_color, height=text_height)
 incorrect_message = TextStim(win=mywin, text="Incorrect!", color=text_incorrect_color, height=text_height)
 too_slow_message = TextStim(win=mywin, text="Too slow!", color=text_too_slow, height=text_height)
@@ -112,11 +140,26 @@ messages_beginning = [beginning_learning_block_message, beginning_transfer_block
 
 end_transfer_message = TextStim(win=mywin, color=text_beginning_block, height=text_height)
 
-#create the dataframe
-data = pd.DataFrame([])
+#create the file where the data are saved trial by trial
+trial_writer = TrialWriter(fileName + '.csv', constants=expInfo)
+# the trials are also kept in memory, with the running accuracy and rt per block (and difficulty level)
+trial_table = TrialTable(n_trials=n_blocks*n_trials,
+                         columns=[('trial', 'i4'), ('rt', 'f8'), ('choice', 'U8'), ('accuracy', 'f8'), ('image', 'U32'), ('block', 'U8'),
+                                  ('difficulty', 'U8'), ('correct_response', 'U8'), ('category', 'U8')],
+                         aggregate=['accuracy', 'rt'], group_by=['block', ('block', 'difficulty')])
 
 #draw the stimuli
-trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key)
+if run_headless: # virtual clock (faster than real time) and random responses
+    trial_routine = headless_routine(frames_per_second, escape_key, RandomResponder(seed=expInfo['participant']))
+else:
+    trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key)
+# draw everything once before the first trial
+trial_routine.warm_up(
+        components=[correct_message, incorrect_message, too_slow_message] + messages_beginning,
+        images=[os.path.join(directory_stimuli, image) for image in stimuli['image']],
+        image_cache=image_cache,
+        image_size=image_size,
+        start_time=start_time)
 
 for bl in range(n_blocks):
     block = blocks[bl]
@@ -128,9 +171,9 @@ for bl in range(n_blocks):
 
     for t in range(n_trials):
         # put here things that change at the beginning of every trial
-        image_trial = 'patch{}.png'.format(block['image_number'][t])
+        image_trial = block['image'][t]
         correct_resp_trial = block['correct_response'][t]
-        patch_image.image = os.path.join(directory_stimuli, image_trial)
+        patch_image = image_cache.get_stim(os.path.join(directory_stimuli, image_trial), size=image_size)
 
         # first event
         trial_routine.wait_for_time_limit(
@@ -162,19 +205,14 @@ for bl in range(n_blocks):
                 time_seconds=messages_duration, 
                 label='choice_feedback')
 
-        data = data.append(
-            {'trial':int(t+1), 'rt':rt, 'choice':key, 'accuracy':accuracy_trial, 'image':image_trial, 'block':['learning', 'transfer'][bl],
-             'difficulty':block['difficulty'][t], 'correct_response':correct_resp_trial, 'category':block['category'][t]},
-            ignore_index=True) # record the responses
-
-        #save data to file
-        for label in expInfo.keys():
-            data[label] = expInfo[label]
-        data.to_csv(fileName + '.csv')
+        trial = {'trial':int(t+1), 'rt':rt, 'choice':key, 'accuracy':accuracy_trial, 'image':image_trial, 'block':['learning', 'transfer'][bl],
+                 'difficulty':block['difficulty'][t], 'correct_response':correct_resp_trial, 'category':block['category'][t]}
+        trial_writer.write(trial) # record the responses
+        trial_table.append(trial)
 
 # final message with accuracy feedback
-accuracy_learning = int(data.loc[data.block == 'learning', 'accuracy'].mean()*100)
-accuracy_transfer = int(data.loc[data.block == 'transfer', 'accuracy'].mean()*100)
+accuracy_learning = int(trial_table.mean('accuracy', block='learning')*100)
+accuracy_transfer = int(trial_table.mean('accuracy', block='transfer')*100)
 
 end_transfer_message.text = "Congratulations, you finished the experiment. You accuracy was {}% in the learning part and {}% in the test.".format(accuracy_learning, accuracy_transfer)
 trial_routine.wait_for_time_limit(
@@ -183,5 +221,6 @@ trial_routine.wait_for_time_limit(
         label='message_end')
 
 #cleanup
+trial_writer.close()
 mywin.close()
 core.quit()
\ No newline at end of file
@@ -1,11 +1,19 @@
 from __future__ import division
-from psychopy.visual import ImageStim, TextStim, Window
-from psychopy import core, event, gui, data, logging
+import os
+import sys
+run_headless = '--headless' in sys.argv # python example_4.py --headless: no display, dialog or keyboard (see headless.py)
+if run_headless:
+    os.environ['PYGLET_HEADLESS'] = '1' # set before psychopy is imported: the stimuli are drawn offscreen
+from psychopy.visual import TextStim, Window
+from psychopy import core, gui, data, logging
 import numpy as np
 import pandas as pd
-import os
 
 from routines import Routine
+from headless import headless_routine, RandomResponder
+from trial_writer import TrialWriter
+from text_pool import TextPool
+from image_cache import ImageCache
 
 # Code for the (simplified) reinforcement learning task from Fontanesi and colleagues (https://doi.org/10.3758/s13423-018-1554-2)
 
@@ -30,21 +38,24 @@ options_x_offset = 200
 image_size = 100
 
 #store info about the experiment session
-dlg = gui.Dlg(title=expName)
-dlg.addField('Participant:', 1)
-dlg.addField('Age:', 25)
-dlg.addField('Gender:', choices=['female', 'male', 'prefer not to disclose'])
-dlg.addField('Handedness:', choices=['right', 'left', 'both'])
-dlg.show()
-
-expInfo = dict(zip(['participant', 'age', 'gender', 'hand'], dlg.data))
+if run_headless: # no dialog: the default values
+    expInfo = {'participant': 1, 'age': 25, 'gender': 'prefer not to disclose', 'hand': 'right'}
+else:
+    dlg = gui.Dlg(title=expName)
+    dlg.addField('Participant:', 1)
+    dlg.addField('Age:', 25)
+    dlg.addField('Gender:', choices=['female', 'male', 'prefer not to disclose'])
+    dlg.addField('Handedness:', choices=['right', 'left', 'both'])
+    dlg.show()
+    expInfo = dict(zip(['participant', 'age', 'gender', 'hand'], dlg.data))
+    if not dlg.OK:  # then the user pressed cancel
+        print(expInfo)
+        core.quit()
+
 expInfo['date'] = data.getDateStr()  # add a simple timestamp
 expInfo['expName'] = expName # add the experiment name
-if dlg.OK:  # then the user pressed OK
-    print(expInfo)
-else:
-    print(expInfo)
-    core.quit()
+print(expInfo)
+start_time = core.getTime() # for the startup time reported by the warm-up
 
 #check if data folder exists
 directory=os.path.join(os.getcwd(), 'data')
@@ -62,11 +73,8 @@ logging.console.setLevel(logging.WARNING)  # this outputs to the screen, not a f
 mywin = Window(screen_size, units='pix', color=background_color, fullscr=full_screen)
 
 #create some stimuli
-left_feedback = TextStim(win=mywin, color=text_color, pos=(-options_x_offset, 0), height=text_height)
-right_feedback = TextStim(win=mywin, color=text_color, pos=(options_x_offset, 0), height=text_height)
-
-left_picture = ImageStim(win=mywin, pos=(-options_x_offset, 0), size=image_size)
-right_picture = ImageStim(win=mywin, pos=(options_x_offset, 0), size=image_size)
+image_cache = ImageCache(window=mywin) # the images are read from disk only once, and then reused
+directory_stimuli = os.path.join(os.getcwd(), 'stimuli', 'example_4')
 
 fixation_cross = TextStim(win=mywin, text='+', color=text_color)
 
@@ -91,19 +99,36 @@ stimuli.loc[stimuli.right_image == 'C.png', 'right_feedback'] = rewards_C
 stimuli = stimuli.sample(frac=1).reset_index(drop=True)
 stimuli['trial'] = np.arange(n_trials)+1
 
-#create the dataframe
-data = pd.DataFrame([])
+left_feedbacks = TextPool(window=mywin, texts=['%s' % f for f in stimuli['left_feedback'].unique()], color=text_color, pos=(-options_x_offset, 0), height=text_height)
+right_feedbacks = TextPool(window=mywin, texts=['%s' % f for f in stimuli['right_feedback'].unique()], color=text_color, pos=(options_x_offset, 0), height=text_height)
+
+image_cache.preload([os.path.join(directory_stimuli, image) for image in stimuli['left_image'].unique()], size=image_size, pos=(-options_x_offset, 0))
+image_cache.preload([os.path.join(directory_stimuli, image) for image in stimuli['right_image'].unique()], size=image_size, pos=(options_x_offset, 0))
+
+#create the file where the data are saved trial by trial
+trial_writer = TrialWriter(fileName + '.csv', constants=expInfo)
 
 #draw the stimuli
-trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key)
+if run_headless: # virtual clock (faster than real time) and random responses
+    trial_routine = headless_routine(frames_per_second, escape_key, RandomResponder(seed=expInfo['participant']))
+else:
+    trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key)
+# draw everything once before the first trial
+trial_routine.warm_up(
+        components=[fixation_cross, left_feedbacks, right_feedbacks],
+        images=[os.path.join(directory_stimuli, image) for image in ['A.png', 'B.png', 'C.png', 'D.png']],
+        image_cache=image_cache,
+        image_size=image_size,
+        image_pos=[(-options_x_offset, 0), (options_x_offset, 0)],
+        start_time=start_time)
 
 for t in range(n_trials):
     # put here things that change every trial
-    left_feedback.text = '%s' % stimuli.loc[t, 'left_feedback']
-    right_feedback.text = '%s' % stimuli.loc[t, 'right_feedback']
+    left_feedback = left_feedbacks.get('%s' % stimuli.loc[t, 'left_feedback'])
+    right_feedback = right_feedbacks.get('%s' % stimuli.loc[t, 'right_feedback'])
     
-    left_picture.image = os.path.join(os.getcwd(), 'stimuli', 'example_4', stimuli.loc[t, 'left_image'])
-    right_picture.image = os.path.join(os.getcwd(), 'stimuli', 'example_4', stimuli.loc[t, 'right_image'])
+    left_picture = image_cache.get_stim(os.path.join(directory_stimuli, stimuli.loc[t, 'left_image']), size=image_size, pos=(-options_x_offset, 0))
+    right_picture = image_cache.get_stim(os.path.join(directory_stimuli, stimuli.loc[t, 'right_image']), size=image_size, pos=(options_x_offset, 0))
 
     # first event
     trial_routine.wait_for_time_limit(
@@ -117,9 +142,9 @@ for t in range(n_trials):
         valid_keys=choice_keys, 
         time_seconds=choice_time_limit, 
         label='gamble_choice')
-    data = data.append({'rt':rt, 'choice': key, 'trial': t, 'f_right': stimuli.loc[t, 'right_feedback'],  'f_left': stimuli.loc[t, 'left_feedback'],
+    trial_writer.write({'rt':rt, 'choice': key, 'trial': t, 'f_right': stimuli.loc[t, 'right_feedback'],  'f_left': stimuli.loc[t, 'left_feedback'],
                         'i_right': stimuli.loc[t, 'right_image'],  'i_left': stimuli.loc[t, 'left_image'], 'trial_type': stimuli.loc[t, 'trial_type'],
-                       }, ignore_index=True) # record the responses
+                       }) # record the responses
     
     # third event
     trial_routine.wait_for_time_limit(
@@ -127,11 +152,8 @@ for t in range(n_trials):
         time_seconds=feedback_duration, 
         label='feedback')
 
-    #save data to file
-    for label in expInfo.keys():
-        data[label] = expInfo[label]
-    data.to_csv(fileName + '.csv')
     
 #cleanup
+trial_writer.close()
 mywin.close()
 core.quit()
\ No newline at end of file
@@ -0,0 +1,178 @@
+from psychopy import logging
+import numpy as np
+
+from routines import Routine
+
+"""
+Stand-ins for the window, the clock and the keyboard, to run experiments without a display and faster than real time.
+Every flip of the HeadlessWindow moves a virtual clock forward by one frame, without waiting,
+and key presses are generated by a responder instead of being read from the keyboard.
+The Routine methods do not change, so they return the same values (key, rt, np.nan on timeout) as in a real session.
+
+Nothing here (nor in Routine, with these stand-ins) imports psychopy.event, which opens a window when imported,
+so it runs without a display. The psychopy stimuli need an OpenGL context: with PYGLET_HEADLESS=1 set before psychopy
+is imported, they are drawn offscreen (as in the examples started with --headless).
+
+Responders are called once per event that collects responses, with the list of valid keys,
+and return the key that is pressed and when (in seconds from the onset), or None for no response.
+"""
+
+class HeadlessWindow(object):
+    def __init__(self, frames_per_second=60, size=(800, 600)):
+        self.frame_period = 1./frames_per_second
+        self.size = size
+        self.time = 0. # virtual time, in seconds
+        self.frame_count = 0
+        self._to_log = []
+        self._to_call = []
+
+    def flip(self, clearBuffer=True):
+        self.time += self.frame_period
+        self.frame_count += 1
+        for function, args, kwargs in self._to_call:
+            function(*args, **kwargs)
+        for level, msg in self._to_log:
+            logging.log(msg=msg, level=level, t=self.time)
+        self._to_call = []
+        self._to_log = []
+        return self.time
+
+    def logOnFlip(self, msg, level, obj=None):
+        self._to_log.append((level, msg))
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._to_call.append((function, args, kwargs))
+
+    def clearBuffer(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+    def getClock(self):
+        return VirtualClock(self)
+
+class VirtualClock(object):
+    """Same as core.Clock, but reading the time of a HeadlessWindow."""
+    def __init__(self, window):
+        self.window = window
+        self._last_reset = window.time
+
+    def getTime(self):
+        return self.window.time - self._last_reset
+
+    def getLastResetTime(self):
+        return self._last_reset
+
+    def reset(self, newT=0.):
+        self._last_reset = self.window.time + newT
+
+class HeadlessEvents(object):
+    """Same getKeys/clearEvents functions as psychopy.event, with key presses generated by a responder.
+    Each key is released hold_duration seconds after being pressed (see getReleases)."""
+    def __init__(self, window, responder, ignore_keys=('escape',), hold_duration=.1):
+        self.window = window
+        self.responder = responder
+        self.ignore_keys = ignore_keys
+        self.hold_duration = hold_duration
+        self._response = None
+        self._release = None
+        self._planned = False
+
+    def clearEvents(self, eventType=None):
+        self._response = None
+        self._release = None
+        self._planned = False # a new event starts: the responder is asked at the next getKeys
+
+    def getKeys(self, keyList=None, timeStamped=False):
+        if not self._planned:
+            self._planned = True
+            valid_keys = [k for k in ([] if keyList is None else keyList) if k not in self.ignore_keys]
+            if len(valid_keys) > 0:
+                response = self.responder(valid_keys)
+                if response is not None:
+                    key, rt = response
+                    # the onset is the first flip of the event, which is the one just done
+                    self._response = (str(key), self.window.time + rt)
+
+        if self._response is None or self._response[1] > self.window.time:
+            return []
+        key, press_time = self._response
+        self._response = None
+        self._release = (key, press_time + self.hold_duration)
+        logging.data('Keypress: %s' % key, t=press_time)
+        if timeStamped:
+            return [(key, press_time - timeStamped.getLastResetTime())]
+        return [key]
+
+    def getReleases(self, keyList=None, timeStamped=False):
+        if self._release is None or self._release[1] > self.window.time:
+            return []
+        key, release_time = self._release
+        self._release = None
+        if keyList is not None and key not in keyList:
+            return []
+        if timeStamped:
+            return [(key, release_time - timeStamped.getLastResetTime())]
+        return [key]
+
+class HeadlessMouse(object):
+    """
+    Same getPos/setPos functions as psychopy.event.Mouse, with a pointer that, after a delay from each setPos,
+    moves in a straight line at a constant speed (in window units per second) to the next of a list of targets.
+    """
+    def __init__(self, window, targets, delay=.3, speed=1000.):
+        self.window = window
+        self.targets = [np.asarray(target, dtype=float) for target in targets]
+        self.delay = delay
+        self.speed = speed
+        self.n_moves = 0
+        self._start = np.zeros(2)
+        self._start_time = window.time
+        self._target = None
+
+    def setPos(self, newPos=(0, 0)):
+        self._start = np.asarray(newPos, dtype=float)
+        self._start_time = self.window.time
+        self._target = self.targets[self.n_moves % len(self.targets)]
+        self.n_moves += 1
+
+    def getPos(self):
+        if self._target is None:
+            return self._start.copy()
+        distance = np.linalg.norm(self._target - self._start)
+        travelled = max(self.window.time - self._start_time - self.delay, 0.)*self.speed
+        if distance == 0 or travelled >= distance:
+            return self._target.copy()
+        return self._start + (self._target - self._start)*travelled/distance
+
+class ScriptedResponder(object):
+    """Gives the responses in a list of (key, rt) pairs, one per event (None for no response)."""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.n_responses = 0
+
+    def __call__(self, valid_keys):
+        response = self.responses[self.n_responses]
+        self.n_responses += 1
+        return response
+
+class RandomResponder(object):
+    """Presses a random valid key after a log-normally distributed response time, and sometimes does not respond."""
+    def __init__(self, rt_median=.8, rt_sigma=.3, p_no_response=0., seed=None):
+        self.rt_median = rt_median
+        self.rt_sigma = rt_sigma
+        self.p_no_response = p_no_response
+        self.rng = np.random.RandomState(seed)
+
+    def __call__(self, valid_keys):
+        if self.rng.uniform() < self.p_no_response:
+            return None
+        return valid_keys[self.rng.randint(len(valid_keys))], self.rt_median*np.exp(self.rt_sigma*self.rng.normal())
+
+def headless_routine(frames_per_second, escape_key, responder, **kwargs):
+    """Returns a Routine running on a HeadlessWindow, with keys given by the responder."""
+    window = HeadlessWindow(frames_per_second=frames_per_second)
+    events = HeadlessEvents(window, responder, ignore_keys=(escape_key,))
+    return Routine(window=window, frames_per_second=frames_per_second, escape_key=escape_key,
+                   timer=window.getClock(), events=events, **kwargs)
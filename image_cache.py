@@ -0,0 +1,113 @@
+from psychopy.visual import ImageStim
+from collections import OrderedDict
+from PIL import Image
+import numpy as np
+import os
+
+"""
+Keeps the images of an experiment in memory, so that they are read and decoded from disk only once.
+Two things are cached:
+1) the decoded images (PIL images), which can be assigned to any ImageStim, keyed by path and size in pixels
+2) ImageStim objects with the texture already uploaded, which can be swapped in a trial at no cost,
+   keyed by path, size, position, units and the other arguments of the ImageStim
+The images are resized when they are decoded only if the size is in pixels: in the other units (e.g., 'deg', 'norm'),
+the number of pixels depends on the monitor, and they are kept at their own resolution and scaled by the ImageStim.
+The least recently used entries are removed when the memory used goes above max_bytes.
+"""
+
+class ImageCache(object):
+    def __init__(self, window, max_bytes=256*2**20):
+        self.window = window
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> (object, n_bytes), from least to most recently used
+
+    @staticmethod
+    def _size_key(size):
+        # the size as given (in any units), as a tuple
+        if size is None:
+            return None
+        if np.ndim(size) == 0:
+            return (float(size), float(size))
+        return tuple(float(s) for s in size)
+
+    @staticmethod
+    def _hashable(value):
+        # lists and arrays (e.g., a color) as tuples, so that they can be part of a key
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return tuple(ImageCache._hashable(v) for v in value)
+        return value
+
+    def _units(self, units):
+        # the units of the ImageStims are the ones of the window, if not given
+        return getattr(self.window, 'units', 'pix') if units is None else units
+
+    def _get(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+        self.misses += 1
+        return None
+
+    def _add(self, key, obj, n_bytes):
+        self._entries[key] = (obj, n_bytes)
+        self.n_bytes += n_bytes
+        while self.n_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self.n_bytes -= evicted_bytes
+            self.evictions += 1
+
+    def get_image(self, path, size=None, units=None):
+        """Returns the decoded image (resized to size, if given in pixels: units, or the units of the window, are 'pix')."""
+        size = self._size_key(size)
+        if size is not None and self._units(units) == 'pix':
+            size = tuple(max(int(round(s)), 1) for s in size)
+        else:
+            size = None # scaled by the ImageStim
+        key = ('image', os.path.abspath(path), size)
+        image = self._get(key)
+        if image is None:
+            image = Image.open(path)
+            image.load() # decode now and not when it is first drawn
+            if size is not None and image.size != size:
+                image = image.resize(size, Image.LANCZOS)
+            self._add(key, image, image.width*image.height*len(image.getbands()))
+        return image
+
+    def get_stim(self, path, size=None, pos=(0, 0), units=None, **kwargs):
+        """
+        Returns an ImageStim showing the image, created the first time it is requested with these arguments.
+        Other arguments are passed to ImageStim when it is created.
+        """
+        units = self._units(units)
+        key = ('stim', os.path.abspath(path), self._size_key(size), self._hashable(pos), units,
+               tuple(sorted((name, self._hashable(value)) for name, value in kwargs.items())))
+        stim = self._get(key)
+        if stim is None:
+            image = self.get_image(path, size, units)
+            stim = ImageStim(win=self.window, image=image, size=size, pos=pos, units=units, name=os.path.basename(path), **kwargs)
+            self._add(key, stim, image.width*image.height*4) # estimate of the texture (RGBA) memory
+        return stim
+
+    def preload(self, paths, size=None, pos=None, units=None, **kwargs):
+        """
+        Fills the cache with the images (or the ImageStims, if a position is given) before the experiment starts.
+        The ImageStims are only found again by get_stim if it is given the same arguments.
+        """
+        for path in paths:
+            if pos is None:
+                self.get_image(path, size, units)
+            else:
+                self.get_stim(path, size, pos, units, **kwargs)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'n_entries': len(self._entries), 'n_bytes': self.n_bytes, 'max_bytes': self.max_bytes}
+
+    def clear(self):
+        self._entries.clear()
+        self.n_bytes = 0
@@ -0,0 +1,112 @@
+from __future__ import division
+from multiprocessing import Pool
+import argparse
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+
+"""
+Collects the .csv files of all sessions in the data folder into a single dataset in Parquet format
+(needs pyarrow), partitioned by experiment, participant and date:
+
+    store/expName=example_4/participant=1/date=2019_Dec_17_1633/data.parquet
+
+The files are read in parallel and their columns are converted to the right types
+(e.g., trial and reward are integers, and not floats as in the .csv files).
+Only new (or changed) session files are read again when ingest is called again,
+and the data of one experiment can then be loaded with only the columns needed (see load).
+"""
+
+PARTITION_COLUMNS = ['expName', 'participant', 'date']
+INTEGER_COLUMNS = ['trial', 'reward', 'current', 'upper', 'lower', 'difference', 'f_left', 'f_right', 'participant', 'age']
+FLOAT_COLUMNS = ['rt', 'accuracy']
+MANIFEST = '_ingested.json'
+
+def read_session(file_name):
+    """Reads the .csv file of one session and converts its columns to the right types."""
+    data = pd.read_csv(file_name, index_col=0)
+    for col in data.columns:
+        if col in INTEGER_COLUMNS:
+            data[col] = data[col].astype('Int64') # integers that can be missing
+        elif col in FLOAT_COLUMNS:
+            data[col] = data[col].astype(np.float64)
+        elif data[col].dtype == object:
+            data[col] = data[col].astype('string')
+    data.index.name = 'row'
+    return data.reset_index()
+
+def _ingest_file(args):
+    file_name, store = args
+    data = read_session(file_name)
+    if len(data) == 0 or any(col not in data for col in PARTITION_COLUMNS):
+        return file_name, 0
+    directory = os.path.join(store, *['%s=%s' % (col, data[col].iloc[0]) for col in PARTITION_COLUMNS])
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    data.drop(columns=PARTITION_COLUMNS).to_parquet(os.path.join(directory, 'data.parquet'), index=False)
+    return file_name, len(data)
+
+def _file_state(file_name):
+    stat = os.stat(file_name)
+    return [stat.st_size, stat.st_mtime]
+
+def ingest(data_directory='data', store='store', processes=4):
+    """
+    Adds to the store the sessions in data_directory that are new or have changed since the last ingest.
+    Returns the list of files that were read.
+    """
+    manifest_file = os.path.join(store, MANIFEST)
+    manifest = dict()
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    file_names = sorted(glob.glob(os.path.join(data_directory, '*.csv')))
+    to_ingest = [file_name for file_name in file_names if manifest.get(os.path.basename(file_name)) != _file_state(file_name)]
+    if len(to_ingest) == 0:
+        return []
+
+    if not os.path.exists(store):
+        os.makedirs(store)
+    if processes > 1 and len(to_ingest) > 1:
+        pool = Pool(processes)
+        results = pool.map(_ingest_file, [(file_name, store) for file_name in to_ingest])
+        pool.close()
+        pool.join()
+    else:
+        results = [_ingest_file((file_name, store)) for file_name in to_ingest]
+
+    for file_name, n_rows in results:
+        manifest[os.path.basename(file_name)] = _file_state(file_name)
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_file + '.tmp', manifest_file) # the manifest is never half written
+    return to_ingest
+
+def load(store, expName, columns=None, participants=None):
+    """
+    Loads the data of one experiment from the store (memory-mapped, reading only the columns given),
+    optionally only for some participants.
+    """
+    filters = None
+    if participants is not None:
+        filters = [('participant', 'in', [str(p) for p in participants])]
+    data = pd.read_parquet(os.path.join(store, 'expName=%s' % expName), columns=columns, filters=filters, memory_map=True)
+    if 'participant' in data:
+        data['participant'] = data['participant'].astype(str).astype('Int64')
+    return data
+
+def main():
+    parser = argparse.ArgumentParser(description='Collects the session files into a Parquet dataset.')
+    parser.add_argument('--data', default='data', help='folder with the .csv files')
+    parser.add_argument('--store', default='store', help='folder of the dataset')
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    ingested = ingest(args.data, args.store, processes=args.processes)
+    print('%d session files ingested' % len(ingested))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import os
+import time
+import numpy as np
+
+"""
+A journal of the completed trials, to resume a session after a crash.
+Every record has a fixed size and is written in a file that is created (with room for max_records) when the session starts
+and is memory-mapped, so that writing a record costs only a few assignments.
+Each record stores the trial number, the values of some variables (e.g., the adaptive state of the experiment)
+and, if a random number generator is given, its state. A record counts only once it is complete,
+so the journal can be read back after a crash and the experiment can continue from the last completed trial:
+
+    journal = Journal(os.path.join('data', '%s_%s_journal.npy' % (expName, expInfo['participant'])), fields=['value_upper', 'value_lower'])
+    last = journal.last() # None if there is nothing to resume
+"""
+
+class Journal(object):
+    def __init__(self, file_name, fields, rng=None, max_records=4096, sync=False):
+        """
+        file_name: path of the journal (.npy), opened again if it exists
+        fields: names of the (numeric) variables to store in every record
+        rng: numpy RandomState (or np.random) whose state is stored in every record and restored by last()
+        sync: if True, every record is also written to disk (slower, but safe also if the computer crashes)
+        """
+        self.fields = list(fields)
+        self.rng = rng
+        self.sync = sync
+        dtype = [('valid', 'u1'), ('finished', 'u1'), ('trial', 'i4'), ('time', 'f8')] + [(field, 'f8') for field in self.fields]
+        if rng is not None:
+            dtype += [('rng_key', 'u4', 624), ('rng_pos', 'i4'), ('rng_has_gauss', 'i4'), ('rng_cached_gaussian', 'f8')]
+        dtype = np.dtype(dtype)
+
+        if os.path.exists(file_name):
+            self.records = np.lib.format.open_memmap(file_name, mode='r+')
+            if self.records.dtype != dtype:
+                raise ValueError('The journal %s has different fields: %s' % (file_name, ', '.join(self.records.dtype.names)))
+            invalid = np.flatnonzero(self.records['valid'] == 0)
+            self.n_records = invalid[0] if len(invalid) > 0 else len(self.records)
+        else:
+            self.records = np.lib.format.open_memmap(file_name, mode='w+', dtype=dtype, shape=(max_records,))
+            self.n_records = 0
+
+    def record(self, trial, **values):
+        """Writes the record of a completed trial, with the values of the fields."""
+        if self.n_records == len(self.records):
+            raise IOError('The journal is full (%d records)' % len(self.records))
+        i = self.n_records
+        records = self.records
+        records['trial'][i] = trial
+        records['time'][i] = time.time()
+        for field in self.fields:
+            records[field][i] = values[field]
+        if self.rng is not None:
+            name, key, pos, has_gauss, cached_gaussian = self.rng.get_state()
+            records['rng_key'][i] = key
+            records['rng_pos'][i] = pos
+            records['rng_has_gauss'][i] = has_gauss
+            records['rng_cached_gaussian'][i] = cached_gaussian
+        records['valid'][i] = 1 # written last: the record counts only if it is complete
+        self.n_records += 1
+        if self.sync:
+            records.flush()
+
+    def finish(self):
+        """Marks the session as finished, so that it is not resumed."""
+        if self.n_records > 0:
+            self.records['finished'][self.n_records - 1] = 1
+            self.records.flush()
+
+    def last(self):
+        """
+        Returns the last record of an unfinished session as a dictionary (trial, time, and the fields),
+        after restoring the state of the random number generator, or None if there is nothing to resume.
+        """
+        if self.n_records == 0 or self.records['finished'][self.n_records - 1]:
+            return None
+        record = self.records[self.n_records - 1]
+        if self.rng is not None:
+            self.rng.set_state(('MT19937', np.array(record['rng_key']), int(record['rng_pos']),
+                                int(record['rng_has_gauss']), float(record['rng_cached_gaussian'])))
+        last = {'trial': int(record['trial']), 'time': float(record['time'])}
+        for field in self.fields:
+            last[field] = float(record[field])
+        return last
+
+    def close(self):
+        self.records.flush()
+        del self.records
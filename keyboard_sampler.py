@@ -0,0 +1,115 @@
+from psychopy import core, logging
+import threading
+import time
+import numpy as np
+
+"""
+Reads the keyboard in a background thread, many times per frame, instead of once per flip.
+Key presses are stored with their timestamp in a ring buffer written only by the thread and read only by the
+frame loops of the Routine (so no lock is needed), and the response times are computed from these timestamps:
+their precision does not depend on the refresh rate or on how long it takes to draw the stimuli.
+
+It has the same getKeys/clearEvents functions as psychopy.event, so it can be given to Routine as events:
+
+    key_sampler = KeyboardSampler(rate=1000)
+    key_sampler.start()
+    trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key, events=key_sampler)
+
+The key releases are stored in a second ring buffer and are read with getReleases (used by the Routine when record_keys=True).
+
+The keyboard is read with psychopy.hardware.keyboard, which needs the psychtoolbox backend to be used outside of the main thread.
+"""
+
+class KeyboardSampler(object):
+    def __init__(self, rate=1000, buffer_size=1024, max_key_length=32, keyboard=None):
+        if keyboard is None:
+            from psychopy.hardware.keyboard import Keyboard
+            keyboard = Keyboard()
+        self.keyboard = keyboard
+        self.interval = 1./rate
+        self.buffer_size = buffer_size
+        self.keys = np.empty(buffer_size, dtype='U%d' % max_key_length) # preallocated ring buffer
+        self.times = np.empty(buffer_size) # press times, on the same clock as core.getTime
+        self.n_written = 0 # changed only by the thread
+        self.n_read = 0 # changed only by the frame loops
+        self.n_lost = 0 # presses overwritten before being read
+        self.released_keys = np.empty(buffer_size, dtype='U%d' % max_key_length) # same for the releases
+        self.release_times = np.empty(buffer_size)
+        self.n_released = 0 # changed only by the thread
+        self.n_released_read = 0 # changed only by the frame loops
+        self._down = [] # presses not released yet, used only by the thread
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self.keyboard.clearEvents()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='KeyboardSampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            for key in self.keyboard.getKeys(waitRelease=False, clear=True):
+                i = self.n_written % self.buffer_size
+                self.keys[i] = key.name
+                self.times[i] = key.tDown
+                self.n_written += 1 # only now the press can be read
+                self._down.append(key)
+            # the duration of a press is set by the keyboard when the key is released
+            still_down = []
+            for key in self._down:
+                if key.duration is None:
+                    still_down.append(key)
+                else:
+                    i = self.n_released % self.buffer_size
+                    self.released_keys[i] = key.name
+                    self.release_times[i] = key.tDown + key.duration
+                    self.n_released += 1
+            self._down = still_down
+            time.sleep(self.interval)
+
+    def clearEvents(self, eventType=None):
+        self.n_read = self.n_written
+        self.n_released_read = self.n_released
+
+    def getKeys(self, keyList=None, timeStamped=False):
+        n_written = self.n_written
+        if n_written - self.n_read > self.buffer_size:
+            self.n_lost += n_written - self.n_read - self.buffer_size
+            self.n_read = n_written - self.buffer_size
+
+        pressed_keys = []
+        while self.n_read < n_written:
+            i = self.n_read % self.buffer_size
+            self.n_read += 1
+            key = str(self.keys[i])
+            if keyList is None or key in keyList:
+                logging.data('Keypress: %s' % key)
+                if timeStamped:
+                    pressed_keys.append((key, timeStamped.getTime() - (core.getTime() - self.times[i])))
+                else:
+                    pressed_keys.append(key)
+        return pressed_keys
+
+    def getReleases(self, keyList=None, timeStamped=False):
+        n_released = self.n_released
+        self.n_released_read = max(self.n_released_read, n_released - self.buffer_size)
+
+        released_keys = []
+        while self.n_released_read < n_released:
+            i = self.n_released_read % self.buffer_size
+            self.n_released_read += 1
+            key = str(self.released_keys[i])
+            if keyList is None or key in keyList:
+                if timeStamped:
+                    released_keys.append((key, timeStamped.getTime() - (core.getTime() - self.release_times[i])))
+                else:
+                    released_keys.append(key)
+        return released_keys
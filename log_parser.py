@@ -0,0 +1,196 @@
+from __future__ import division
+from array import array
+from multiprocessing import Pool
+import argparse
+import fnmatch
+import os
+import numpy as np
+import pandas as pd
+
+"""
+Reads back the .log files written during the experiments, line by line (without loading whole files in memory),
+keeping only the lines written by the Routine class and by the stimuli:
+- '<label> onset' and '<label> offset' (event: onset/offset, label: the label of the Routine event)
+- 'Keypress: <key>' (event: keypress, label: the key)
+- '<stimulus name>: <attribute> = <value>' (event: change, label: the stimulus name)
+
+The result is a dataframe with columns time, level, label, event (and session, when reading many files),
+which can be used to check the actual duration of the events against the requested one (see audit),
+also when the same label has different durations in different experiments. The events with a key press between
+their onset and offset are marked (response column): the ones that end at the response are shorter than requested
+by design, so they are counted apart and left out of the errors.
+"""
+
+EVENTS = ['onset', 'offset', 'keypress', 'change']
+
+def read_log(file_name):
+    """Reads one log file and returns a dataframe with columns time, level, label, event."""
+    times = array('d')
+    level_codes = array('i')
+    label_codes = array('i')
+    event_codes = array('b')
+    levels = dict()
+    labels = dict()
+
+    with open(file_name) as f:
+        for line in f:
+            parts = line.split('\t', 2)
+            if len(parts) < 3:
+                continue
+            try:
+                t = float(parts[0])
+            except ValueError:
+                continue
+            msg = parts[2].strip()
+
+            if msg.endswith(' onset'):
+                label, ev = msg[:-6], 0
+            elif msg.endswith(' offset'):
+                label, ev = msg[:-7], 1
+            elif msg.startswith('Keypress: '):
+                label, ev = msg[10:], 2
+            else:
+                name = msg.split(' = ', 1)[0]
+                if name == msg or ': ' not in name:
+                    continue
+                label, ev = name.split(': ', 1)[0], 3
+
+            times.append(t)
+            level_codes.append(levels.setdefault(parts[1].strip(), len(levels)))
+            label_codes.append(labels.setdefault(label, len(labels)))
+            event_codes.append(ev)
+
+    return pd.DataFrame({
+        'time': np.frombuffer(times, dtype=np.float64) if len(times) > 0 else np.array([], dtype=np.float64),
+        'level': pd.Categorical.from_codes(np.array(level_codes, dtype=np.int32), categories=list(levels)),
+        'label': pd.Categorical.from_codes(np.array(label_codes, dtype=np.int32), categories=list(labels)),
+        'event': pd.Categorical.from_codes(np.array(event_codes, dtype=np.int8), categories=EVENTS),
+    })
+
+def read_logs(file_names, processes=1):
+    """Reads many log files (in parallel, if processes > 1) and returns a single dataframe with a session column."""
+    if processes > 1:
+        pool = Pool(processes)
+        logs = pool.map(read_log, file_names)
+        pool.close()
+        pool.join()
+    else:
+        logs = [read_log(file_name) for file_name in file_names]
+
+    sessions = [os.path.splitext(os.path.basename(file_name))[0] for file_name in file_names]
+    for session, log in zip(sessions, logs):
+        log.insert(0, 'session', pd.Categorical([session]*len(log), categories=sessions))
+    data = pd.concat(logs, ignore_index=True)
+    data['label'] = data['label'].astype('category') # categories differ across files
+    return data
+
+def _session_matches(session, pattern):
+    # pattern: the experiment name (sessions are named <expName>_<participant>_<date>), or a pattern of session names
+    return session.startswith(pattern + '_') or fnmatch.fnmatchcase(session, pattern)
+
+def requested_durations(labels, sessions, requested):
+    """
+    Requested duration of every event, given its label and session (or None), with requested as a dictionary
+    label -> time_seconds (for all the sessions) and/or experiment name (or session pattern, e.g. 'example_3_1_*')
+    -> dictionary label -> time_seconds, e.g. {'feedback': 2, 'example_2': {'fixation_cross': 1}, 'example_3': {'fixation_cross': 1.5}}.
+    The durations given for an experiment replace the ones for all the sessions, and the first matching experiment is used.
+    np.nan where no duration is requested.
+    """
+    labels = pd.Series(labels)
+    result = labels.map(dict((k, v) for k, v in requested.items() if not isinstance(v, dict))).to_numpy(dtype=float, copy=True)
+    if sessions is not None:
+        sessions = np.asarray(sessions)
+        names = np.unique(sessions)
+        for pattern, durations in reversed(list(requested.items())): # the first matching one is applied last
+            if not isinstance(durations, dict):
+                continue
+            matching = names[[_session_matches(name, pattern) for name in names]]
+            if len(matching) == 0:
+                continue
+            values = labels.map(durations).astype(float).values
+            replace = np.isin(sessions, matching) & ~np.isnan(values)
+            result[replace] = values[replace]
+    return result
+
+def event_durations(logs, requested=None):
+    """
+    Pairs every onset with the following offset (of the same label and session) and returns a dataframe
+    with columns (session,) label, onset, duration, response (True if a key was pressed between the onset and the offset)
+    and, if requested is given (see requested_durations), requested and error (duration - requested).
+    """
+    events = logs[logs['event'].isin(['onset', 'offset'])].reset_index(drop=True)
+    is_onset = (events['event'] == 'onset').values
+    next_is_offset = np.append((events['event'] == 'offset').values[1:], False)
+    labels = events['label'].astype(str).values
+    same_label = np.append(labels[1:] == labels[:-1], False) if len(labels) > 0 else np.array([], dtype=bool)
+    valid = is_onset & next_is_offset & same_label
+    if 'session' in events:
+        sessions = events['session'].astype(str).values
+        valid &= np.append(sessions[1:] == sessions[:-1], False) if len(sessions) > 0 else np.array([], dtype=bool)
+
+    times = events['time'].values
+    index = np.flatnonzero(valid)
+    durations = pd.DataFrame({'label': labels[index], 'onset': times[index], 'duration': times[index + 1] - times[index]})
+    durations['response'] = np.zeros(len(durations), dtype=bool)
+    keypresses = logs[logs['event'] == 'keypress']
+    if 'session' in events:
+        durations.insert(0, 'session', sessions[index])
+        keypress_sessions = keypresses['session'].astype(str).values
+    for session in (np.unique(durations['session'].values) if 'session' in durations else [None]):
+        if session is None:
+            rows, keypress_times = np.arange(len(durations)), keypresses['time'].values
+        else:
+            rows, keypress_times = np.flatnonzero(durations['session'].values == session), keypresses['time'].values[keypress_sessions == session]
+        keypress_times = np.sort(keypress_times)
+        onsets = durations['onset'].values[rows]
+        offsets = onsets + durations['duration'].values[rows]
+        n_keypresses = np.searchsorted(keypress_times, offsets, side='right') - np.searchsorted(keypress_times, onsets, side='left')
+        durations.loc[rows[n_keypresses > 0], 'response'] = True
+    if requested is not None:
+        durations['requested'] = requested_durations(durations['label'].values, durations['session'].values if 'session' in durations else None, requested)
+        durations['error'] = durations['duration'] - durations['requested']
+    return durations
+
+def audit(logs, requested, by_session=True):
+    """
+    Compares the actual durations of the events with the requested ones (for all the sessions and/or per experiment,
+    see requested_durations), and returns, per label (and session), the number of events and the mean, sd, min and max error in seconds.
+    The events with a key press (e.g., ended by the response) are left out of the errors, and counted in the responses column.
+    """
+    durations = event_durations(logs, requested)
+    durations = durations[durations['requested'].notnull()]
+    groups = ['session', 'label'] if by_session and 'session' in durations else ['label']
+    errors = durations[~durations['response']].groupby(groups)['error'].agg(['count', 'mean', 'std', 'min', 'max'])
+    responses = durations.groupby(groups)['response'].sum().rename('responses')
+    result = pd.concat([errors, responses], axis=1) # also the labels whose events all had a response
+    result['count'] = result['count'].fillna(0).astype(int)
+    result['responses'] = result['responses'].fillna(0).astype(int)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Timing audit of the log files written by Routine.')
+    parser.add_argument('logs', nargs='+', help='log files')
+    parser.add_argument('--requested', nargs='*', default=[],
+                        help='requested durations as label=seconds, e.g. fixation_cross=1, or for one experiment (or session pattern) '
+                             'as experiment:label=seconds, e.g. example_3:fixation_cross=1.5')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--by-session', action='store_true')
+    args = parser.parse_args()
+
+    requested = dict()
+    for item in args.requested:
+        label, seconds = item.split('=')
+        if ':' in label:
+            experiment, label = label.split(':', 1)
+            requested.setdefault(experiment, dict())[label] = float(seconds)
+        else:
+            requested[label] = float(seconds)
+
+    logs = read_logs(args.logs, processes=args.processes)
+    if len(requested) > 0:
+        print(audit(logs, requested, by_session=args.by_session))
+    else:
+        print(event_durations(logs).groupby('label')['duration'].describe())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+from psychopy import logging
+import atexit
+import json
+import threading
+import time
+import numpy as np
+
+"""
+Keeps the log messages of the Routine events (onset, offset, key presses) in memory while the frames are drawn,
+and writes them to a file in a background thread, so that no file is written during the frame loops.
+Messages are stored in a preallocated ring buffer as (time, level, message code, values) records, where the code
+refers to a table of the (few, repeated) messages. The numbers that change from one message to the next
+(e.g., a drift in ms) are not part of the message, which is then a format (e.g., 'fixation_cross drift: %.1f ms'),
+but are stored in the record (at most MAX_VALUES), so that the table does not grow during the session.
+The thread writes the records when no event is running (between events and trials), when the buffer is half full,
+or when they have been waiting for max_delay seconds (the events of a trial often follow each other without a pause,
+and the records should not be kept only in memory, where a crash would lose them).
+
+The file has the same text format of the PsychoPy log files ('<time> \t<LEVEL> \t<message>'),
+or, with binary=True, the raw records (plus a .json file with the messages).
+To use it, give it to the Routine class:
+
+    log_sink = LogSink(fileName + '_events.log')
+    trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key, log_sink=log_sink)
+    ...
+    log_sink.close()
+"""
+
+MAX_VALUES = 6
+RECORD = np.dtype([('time', 'f8'), ('level', 'i1'), ('code', 'i4'), ('n_values', 'i1'), ('values', 'f8', (MAX_VALUES,))])
+
+class LogSink(object):
+    def __init__(self, file_name, binary=False, capacity=2**16, flush_interval=.2, max_delay=2.):
+        self.file_name = file_name
+        self.binary = binary
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.max_delay = max_delay # the records are written at least this often, also while events are running
+        self.records = np.zeros(capacity, dtype=RECORD) # preallocated ring buffer
+        self.messages = [] # message (or format) of each code
+        self._codes = dict() # message -> code
+        self.n_written = 0 # changed only by the frame loops
+        self.n_read = 0 # changed only by the thread
+        self.n_lost = 0
+        self.busy = False # True while an event is running: the thread only writes then after max_delay (or when half full)
+
+        self._file = open(file_name, 'wb' if binary else 'w')
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='LogSink')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close) # write what is left also when the experiment is quit with the escape key
+
+    def write(self, t, level, msg, *values):
+        """
+        Stores a message in the buffer (no formatting and no file access). msg should be one of a few repeated messages:
+        the numbers that change are given as values, and msg is then their format (e.g., write(t, level, 'drift: %.1f ms', 2.3)).
+        """
+        code = self._codes.get(msg)
+        if code is None:
+            code = len(self.messages)
+            self.messages.append(msg)
+            self._codes[msg] = code
+        if self.n_written - self.n_read >= self.capacity:
+            self.n_lost += 1 # the thread could not keep up: the message is dropped
+            return
+        i = self.n_written % self.capacity
+        self.records['time'][i] = t
+        self.records['level'][i] = level
+        self.records['code'][i] = code
+        self.records['n_values'][i] = len(values)
+        for j, value in enumerate(values):
+            self.records['values'][i, j] = np.nan if value is None else value
+        self.n_written += 1 # only now the record can be read
+
+    def _run(self):
+        last_flush = time.time()
+        while self._running:
+            time.sleep(self.flush_interval)
+            if not self.busy or self.n_written - self.n_read > self.capacity//2 or time.time() - last_flush >= self.max_delay:
+                self.flush()
+                last_flush = time.time()
+
+    def flush(self):
+        """Writes to the file all the records in the buffer."""
+        n_written = self.n_written
+        if n_written == self.n_read:
+            return
+        start = self.n_read % self.capacity
+        stop = start + (n_written - self.n_read)
+        if stop <= self.capacity:
+            records = self.records[start:stop].copy()
+        else:
+            records = np.concatenate([self.records[start:], self.records[:stop - self.capacity]])
+        self.n_read = n_written
+
+        if self.binary:
+            self._file.write(records.tobytes())
+        else:
+            self._file.write(''.join(['%.4f \t%s \t%s\n' % (record['time'], logging.getLevel(int(record['level'])), format_message(record, self.messages))
+                                      for record in records]))
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._running = False
+        self._thread.join()
+        self.flush()
+        self._file.close()
+        if self.binary:
+            with open(self.file_name + '.json', 'w') as f:
+                json.dump(self.messages, f)
+
+def format_message(record, messages):
+    """The text of the message of a record (with its values)."""
+    msg = messages[record['code']]
+    if record['n_values'] == 0:
+        return msg
+    values = tuple(record['values'][:record['n_values']])
+    try:
+        return msg % values
+    except (TypeError, ValueError): # e.g., a format that does not match the values: written as they are
+        return '%s %s' % (msg, values)
+
+def read_binary_log(file_name):
+    """Reads a binary log file written by LogSink, and returns the records and the list of messages (see format_message)."""
+    with open(file_name + '.json') as f:
+        messages = json.load(f)
+    return np.fromfile(file_name, dtype=RECORD), messages
@@ -0,0 +1,166 @@
+from __future__ import division
+from multiprocessing import Pool
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+"""
+Generates sets of patches (sine-wave gratings in a circular aperture) as the ones of example 3, for category learning
+experiments, instead of drawing them by hand.
+
+Every patch is a point (x, y) of a stimulus space from 0 to 100 on both dimensions, where x sets the spatial frequency
+(FREQUENCY_RANGE, in cycles per image) and y the orientation (ORIENTATION_RANGE, in degrees). Each category is a bivariate
+normal distribution in this space, and the difficulty of a patch is how much more likely it is under its own category
+than under the most likely other category (log likelihood ratio): the levels give the range of the ratio
+(e.g., the hard patches are close to the optimal category boundary).
+
+The images of a batch are computed together as numpy arrays, and the batches are rendered in parallel (if processes > 1).
+Everything goes into a cache directory: each image is saved with the hash of what it shows as file name (so that it is
+rendered only once, also if it is in the sets of many participants), and the table of each set (the same columns
+as the one of example 3, with image, x, y, frequency and orientation) with the hash of the parameters of the set,
+so that the same set (e.g., the one of a participant, by seed) is only generated once:
+
+    stimuli = generate_patches(n_per_level=5, correct_responses=['a', 'b'], image_size=100, seed=expInfo['participant'])
+    image_path = os.path.join(PATCH_CACHE, stimuli['image'][0])
+
+The sets of many participants can also be generated in advance from the command line:
+
+    python patches.py --participants 100 --n-per-level 50 --image-size 100 --processes 4
+"""
+
+PATCH_CACHE = os.path.join('stimuli', 'patches')
+FREQUENCY_RANGE = (1., 8.) # cycles per image, for x from 0 to 100
+ORIENTATION_RANGE = (0., 90.) # degrees, for y from 0 to 100
+LUMINANCE_RANGE = (110, 255) # darkest and brightest pixel values of the gratings (as in the patches of example 3)
+CATEGORIES = {'A': {'mean': [45., 55.], 'cov': [[225., 202.5], [202.5, 225.]]},
+              'B': {'mean': [55., 45.], 'cov': [[225., 202.5], [202.5, 225.]]}} # optimal boundary on the diagonal
+LEVELS = {'easy': [5., np.inf], 'medium': [2., 5.], 'hard': [0., 2.]} # ranges of the log likelihood ratio
+
+def _log_density(points, category):
+    # log density (without the 2*pi constant, the same for all the categories) of the points of shape (n, 2)
+    cov = np.asarray(category['cov'], dtype=float)
+    centered = points - np.asarray(category['mean'], dtype=float)
+    return -.5*np.einsum('ni,ij,nj->n', centered, np.linalg.inv(cov), centered) - .5*np.log(np.linalg.det(cov))
+
+def sample_patches(n_per_level=5, categories=CATEGORIES, levels=LEVELS, correct_responses=('a', 'b'), seed=None, batch_size=1024):
+    """
+    Returns a table with n_per_level patches for every category and every level of difficulty, sorted by category and level
+    (as the one of example 3), with the position in the stimulus space (x, y), frequency, orientation and log likelihood ratio.
+    The patches are sampled from the distribution of their category, keeping the ones within the stimulus space
+    and within the range of their level.
+    """
+    rng = np.random.RandomState(seed)
+    names = list(categories)
+    rows = []
+    for c, name in enumerate(names):
+        for level, (low, high) in levels.items():
+            kept, ratios, n_kept = [], [], 0
+            while n_kept < n_per_level:
+                candidates = rng.multivariate_normal(categories[name]['mean'], categories[name]['cov'], size=batch_size)
+                densities = np.array([_log_density(candidates, categories[other]) for other in names])
+                ratio = densities[c] - np.delete(densities, c, axis=0).max(axis=0)
+                keep = np.all((candidates >= 0) & (candidates <= 100), axis=1) & (ratio >= low) & (ratio < high)
+                kept.append(candidates[keep])
+                ratios.append(ratio[keep])
+                n_kept += np.sum(keep)
+            points = np.concatenate(kept)[:n_per_level]
+            llr = np.concatenate(ratios)[:n_per_level]
+            rows.append(pd.DataFrame({'category': name, 'correct_response': correct_responses[c], 'difficulty': level,
+                                      'x': points[:, 0], 'y': points[:, 1], 'llr': llr}))
+    stimuli = pd.concat(rows, ignore_index=True)
+    stimuli['frequency'] = FREQUENCY_RANGE[0] + (FREQUENCY_RANGE[1] - FREQUENCY_RANGE[0])*stimuli['x']/100
+    stimuli['orientation'] = ORIENTATION_RANGE[0] + (ORIENTATION_RANGE[1] - ORIENTATION_RANGE[0])*stimuli['y']/100
+    stimuli.insert(0, 'image_number', np.arange(1, len(stimuli) + 1))
+    return stimuli
+
+def render(frequency, orientation, image_size=256, contrast=1.):
+    """
+    Returns the RGBA images (uint8 array of shape (n, image_size, image_size, 4)) of the gratings with the given
+    frequencies (cycles per image) and orientations (degrees), transparent outside of the circular aperture.
+    """
+    frequency = np.asarray(frequency, dtype=float)[:, None, None]
+    theta = np.deg2rad(np.asarray(orientation, dtype=float))[:, None, None]
+    u = (np.arange(image_size) + .5)/image_size - .5
+    x, y = u[None, None, :], -u[None, :, None] # the rows of the image go from top to bottom
+    grating = np.sin(2*np.pi*frequency*(x*np.cos(theta) + y*np.sin(theta)))
+    low, high = LUMINANCE_RANGE
+    luminance = (low + high)/2 + contrast*(high - low)/2*grating
+
+    images = np.empty(luminance.shape + (4,), dtype=np.uint8)
+    images[..., :3] = np.round(luminance)[..., None]
+    radius = np.sqrt(x**2 + y**2)
+    images[..., 3] = np.round(255*np.clip((.5 - radius)*image_size + .5, 0, 1)) # antialiased edge
+    return images
+
+def _hash(content):
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()[:16]
+
+def image_name(frequency, orientation, image_size=256, contrast=1.):
+    """File name of a patch in the cache: the hash of everything that defines the image."""
+    return 'patch_%s.png' % _hash([round(float(frequency), 6), round(float(orientation), 6), int(image_size), float(contrast),
+                                    FREQUENCY_RANGE, ORIENTATION_RANGE, LUMINANCE_RANGE])
+
+def _render_chunk(args):
+    # renders and saves a chunk of patches (in a worker process)
+    from PIL import Image
+    paths, frequency, orientation, image_size, contrast = args
+    for path, image in zip(paths, render(frequency, orientation, image_size, contrast)):
+        Image.fromarray(image, 'RGBA').save(path)
+    return len(paths)
+
+def generate_patches(n_per_level=5, categories=CATEGORIES, levels=LEVELS, correct_responses=('a', 'b'), image_size=256,
+                     contrast=1., seed=None, cache_dir=PATCH_CACHE, processes=4, chunk_size=64):
+    """
+    Returns the table of a set of patches (see sample_patches) with the file name of every image in cache_dir (image column),
+    generating the table and the images that are not in the cache yet, in chunks of chunk_size images rendered in parallel.
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    parameters = {'n_per_level': n_per_level, 'categories': categories, 'levels': levels, 'correct_responses': list(correct_responses),
+                  'image_size': image_size, 'contrast': contrast, 'seed': seed,
+                  'space': [FREQUENCY_RANGE, ORIENTATION_RANGE, LUMINANCE_RANGE]}
+    table_file = os.path.join(cache_dir, 'set_%s.csv' % _hash(parameters))
+    if os.path.exists(table_file):
+        stimuli = pd.read_csv(table_file)
+    else:
+        stimuli = sample_patches(n_per_level, categories, levels, correct_responses, seed)
+        stimuli['image'] = [image_name(f, o, image_size, contrast) for f, o in zip(stimuli['frequency'], stimuli['orientation'])]
+
+    missing = np.array([not os.path.exists(os.path.join(cache_dir, image)) for image in stimuli['image']], dtype=bool)
+    todo = stimuli[missing].drop_duplicates('image')
+    jobs = [([os.path.join(cache_dir, image) for image in chunk['image']], chunk['frequency'].values, chunk['orientation'].values,
+             image_size, contrast) for chunk in [todo.iloc[start:start + chunk_size] for start in range(0, len(todo), chunk_size)]]
+    if processes > 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        pool.map(_render_chunk, jobs)
+        pool.close()
+        pool.join()
+    else:
+        for job in jobs:
+            _render_chunk(job)
+
+    if not os.path.exists(table_file): # written last, so that a set in the cache always has all its images
+        stimuli.to_csv(table_file, index=False)
+    return stimuli
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates the sets of patches of many participants in the cache.')
+    parser.add_argument('--participants', type=int, default=1, help='one set for each participant from 1 (used as seed)')
+    parser.add_argument('--n-per-level', type=int, default=5)
+    parser.add_argument('--image-size', type=int, default=256)
+    parser.add_argument('--contrast', type=float, default=1.)
+    parser.add_argument('--responses', nargs='+', default=['a', 'b'], help='correct response of each category')
+    parser.add_argument('--cache-dir', default=PATCH_CACHE)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    for participant in range(1, args.participants + 1):
+        stimuli = generate_patches(args.n_per_level, correct_responses=args.responses, image_size=args.image_size,
+                                   contrast=args.contrast, seed=participant, cache_dir=args.cache_dir, processes=args.processes)
+        print('participant %d: %d patches' % (participant, len(stimuli)))
+
+if __name__ == '__main__':
+    main()
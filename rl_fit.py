@@ -0,0 +1,239 @@
+from __future__ import division
+from multiprocessing import Pool
+import argparse
+import numpy as np
+import pandas as pd
+
+"""
+Fits a Q-learning model with softmax choice rule to the data of example 4, for many participants at once.
+
+The trials are looped over only once, and at each trial the Q values of all the participants and of all the
+parameter values (a grid, or the restarts of the optimization) are updated together as numpy arrays:
+
+    data = pd.concat([pd.read_csv(f) for f in glob.glob(os.path.join('data', 'example_4_*.csv'))])
+    task = prepare(data)
+    grid = grid_search(task, alphas=np.linspace(0, 1, 51), betas=np.linspace(0, 2, 51))
+    fits = fit(task, n_restarts=10, processes=4)
+
+The model:
+- the value Q of the chosen option (of both shown options, with full_feedback=True) is updated with the feedback f
+  as Q = Q + alpha*(f - Q), with learning rate alpha in [0, 1], and starts at q0
+- the probability of choosing the right option is 1/(1 + exp(-beta*(Q_right - Q_left))), with inverse temperature beta
+
+Trials without a response do not count in the likelihood and do not change the Q values of the chosen option.
+"""
+
+OPTIONS = ['A.png', 'B.png', 'C.png', 'D.png']
+
+def prepare(data, choice_keys=('q', 'p'), options=OPTIONS):
+    """
+    Turns the trials of example 4 (as saved in the .csv files, or loaded with ingest.load) into arrays of shape
+    (n_participants, n_trials), padded with missing trials for participants with fewer trials.
+    Returns a dictionary with participants, left, right (option indices), choice (0 left, 1 right, -1 no response),
+    f_left and f_right.
+    """
+    sort_by = [c for c in ['participant', 'date', 'trial'] if c in data]
+    data = data.sort_values(sort_by, kind='mergesort')
+    participants, rows = np.unique(data['participant'].values, return_inverse=True)
+    columns = np.concatenate([np.arange(n) for n in np.bincount(rows)]) # trial number within participant (rows are sorted)
+    shape = (len(participants), columns.max() + 1)
+
+    option_index = dict((option, i) for i, option in enumerate(options))
+    task = {'participants': participants}
+    for name, values in [('left', data['i_left'].map(option_index)), ('right', data['i_right'].map(option_index))]:
+        task[name] = np.zeros(shape, dtype=np.intp)
+        task[name][rows, columns] = values.values
+    task['choice'] = np.full(shape, -1, dtype=np.int8)
+    choice = data['choice'].values
+    task['choice'][rows, columns] = np.where(choice == choice_keys[0], 0, np.where(choice == choice_keys[1], 1, -1))
+    for name in ['f_left', 'f_right']:
+        task[name] = np.zeros(shape)
+        task[name][rows, columns] = data[name].values
+    return task
+
+def log_likelihood(task, alpha, beta, q0=0., full_feedback=False, gradient=False):
+    """
+    Log likelihood of the choices of each participant, for many values of alpha and beta: alpha and beta are
+    broadcast to shape (n_participants, n_sets) (e.g. (n_participants, 1) and (1, n_sets), or scalars), and
+    the result has that shape. With gradient=True also returns the derivatives with respect to alpha and beta.
+    """
+    n_participants, n_trials = task['choice'].shape
+    shape = np.broadcast(np.empty((n_participants, 1)), alpha, beta).shape
+    alpha = np.broadcast_to(alpha, shape)
+    beta = np.broadcast_to(beta, shape)
+    n_options = max(task['left'].max(), task['right'].max()) + 1
+
+    # the Q values are a flat array, indexed by (participant, set, option): flat indices are faster than 3 index arrays
+    q = np.full(shape[0]*shape[1]*n_options, q0, dtype=float)
+    base = (np.arange(shape[0])[:, None]*shape[1] + np.arange(shape[1])[None, :])*n_options
+    loglik = np.zeros(shape)
+    if gradient:
+        dq = np.zeros_like(q) # derivative of the Q values with respect to alpha (they do not depend on beta)
+        d_alpha = np.zeros(shape)
+        d_beta = np.zeros(shape)
+
+    for t in range(n_trials):
+        left = base + task['left'][:, t:t + 1]
+        right = base + task['right'][:, t:t + 1]
+        choice = task['choice'][:, t:t + 1]
+        responded = choice >= 0
+        sign = np.where(choice == 1, 1., -1.)
+
+        q_diff = q.take(right) - q.take(left)
+        z = sign*beta*q_diff
+        loglik -= responded*np.logaddexp(0, -z) # log(sigmoid(z))
+        if gradient:
+            dz = responded*sign*np.exp(-np.logaddexp(0, z)) # d log(sigmoid(z)) / dz = 1 - sigmoid(z), times dz/d(beta*q_diff)
+            d_beta += dz*q_diff
+            d_alpha += dz*beta*(dq.take(right) - dq.take(left))
+
+        # update the Q values with the feedback
+        updates = [(right, task['f_right'][:, t:t + 1], choice == 1), (left, task['f_left'][:, t:t + 1], choice == 0)]
+        for option, feedback, chosen in updates:
+            rate = alpha if full_feedback else alpha*chosen
+            q_option = q.take(option)
+            error = feedback - q_option
+            if gradient:
+                dq[option] = dq.take(option)*(1 - rate) + (error if full_feedback else error*chosen)
+            q[option] = q_option + rate*error
+
+    if gradient:
+        return loglik, d_alpha, d_beta
+    return loglik
+
+def grid_search(task, alphas, betas, max_bytes=2**28, **model):
+    """
+    Computes the log likelihood of every participant for all the combinations of alphas and betas (in chunks of
+    at most max_bytes of Q values), and returns a dataframe with the best alpha, beta and log_likelihood
+    of each participant, and the (n_participants, len(alphas), len(betas)) array of log likelihoods.
+    """
+    alpha_grid, beta_grid = [g.ravel() for g in np.meshgrid(alphas, betas, indexing='ij')]
+    n_participants = len(task['participants'])
+    n_options = max(task['left'].max(), task['right'].max()) + 1
+    chunk = max(1, int(max_bytes//(8*n_options*n_participants)))
+    loglik = np.empty((n_participants, len(alpha_grid)))
+    for start in range(0, len(alpha_grid), chunk):
+        stop = start + chunk
+        loglik[:, start:stop] = log_likelihood(task, alpha_grid[None, start:stop], beta_grid[None, start:stop], **model)
+
+    best = np.argmax(loglik, axis=1)
+    fits = pd.DataFrame({'participant': task['participants'], 'alpha': alpha_grid[best], 'beta': beta_grid[best],
+                         'log_likelihood': loglik[np.arange(n_participants), best]})
+    return fits, loglik.reshape(n_participants, len(alphas), len(betas))
+
+def _select(task, index):
+    return dict((name, values[index]) for name, values in task.items())
+
+def _free(x):
+    # the optimization is done on logit(alpha) and log(beta), where the likelihood is closer to quadratic
+    # (at small alpha and beta it depends mostly on their product) and the bounds are further away
+    alpha = np.clip(x[..., 0], 1e-6, 1 - 1e-6)
+    return np.stack([np.log(alpha/(1 - alpha)), np.log(np.maximum(x[..., 1], 1e-6))], axis=-1)
+
+def _natural(y):
+    return np.stack([1/(1 + np.exp(-y[..., 0])), np.exp(y[..., 1])], axis=-1)
+
+def _derivatives(task, y, step, model):
+    # log likelihood, gradient and hessian (from differences of the gradient) at y, of shape (n_problems, 2),
+    # computed with a single call: the shifted points are additional sets
+    x = _natural(np.stack([y, y + [step, 0], y + [0, step]], axis=1)) # (n_problems, 3, 2)
+    loglik, d_alpha, d_beta = log_likelihood(task, x[..., 0], x[..., 1], gradient=True, **model)
+    gradients = np.stack([d_alpha, d_beta], axis=-1)*np.stack([x[..., 0]*(1 - x[..., 0]), x[..., 1]], axis=-1)
+    hessian = (gradients[:, 1:] - gradients[:, :1])/step
+    return loglik[:, 0], gradients[:, 0], (hessian + np.swapaxes(hessian, 1, 2))/2
+
+def _fit_chunk(args):
+    # every restart of every participant of the chunk is a problem (a row of the task), and all the problems
+    # are optimized together, with Newton steps damped (Levenberg-Marquardt) separately for each of them:
+    # a step is taken only if it increases the likelihood, otherwise the damping is increased and the next step
+    # is shorter and closer to the gradient. The problems that converged are left out of the next iterations.
+    task, starts, bounds, model, max_iterations, tolerance = args
+    n_participants, n_restarts = starts.shape[:2]
+    problems = _select(task, np.repeat(np.arange(n_participants), n_restarts))
+    low, high = _free(np.array(bounds).T)
+    y = _free(starts.reshape(-1, 2))
+    loglik, grad, hessian = _derivatives(problems, y, 1e-5, model)
+    damping = np.full(len(y), 1e-3)
+    active = np.arange(len(y))
+    for iteration in range(max_iterations):
+        # the parameters at a bound, with the gradient pointing outside, are kept fixed
+        y_active = y[active]
+        fixed = (y_active <= low) & (grad < 0) | (y_active >= high) & (grad > 0)
+        grad = np.where(fixed, 0, grad)
+        a = -hessian + damping[active, None, None]*(np.abs(hessian) + 1)*np.eye(2)
+        a[:, 0, 1] = a[:, 1, 0] = np.where(fixed.any(axis=1), 0, a[:, 0, 1])
+        det = a[:, 0, 0]*a[:, 1, 1] - a[:, 0, 1]*a[:, 1, 0]
+        det = np.where(np.abs(det) > 0, det, 1e-300)
+        step = np.stack([a[:, 1, 1]*grad[:, 0] - a[:, 0, 1]*grad[:, 1],
+                         a[:, 0, 0]*grad[:, 1] - a[:, 1, 0]*grad[:, 0]], axis=1)/det[:, None]
+        new_y = np.clip(y_active + step, low, high)
+        new_x = _natural(new_y)
+        active_problems = _select(problems, active)
+        new_loglik = log_likelihood(active_problems, new_x[:, :1], new_x[:, 1:], **model)[:, 0]
+        better = new_loglik > loglik[active]
+        done = (np.abs(new_y - y_active).max(axis=1) < tolerance) | better & (new_loglik - loglik[active] < tolerance) \
+               | ~better & (damping[active] > 1e10)
+        y[active] = np.where(better[:, None], new_y, y_active)
+        loglik[active] = np.where(better, new_loglik, loglik[active])
+        damping[active] = np.where(better, damping[active]/10, damping[active]*10)
+        active = active[~done]
+        if len(active) == 0:
+            break
+        loglik[active], grad, hessian = _derivatives(_select(problems, active), y[active], 1e-5, model)
+    return _natural(y).reshape(n_participants, n_restarts, 2), loglik.reshape(n_participants, n_restarts)
+
+def fit(task, n_restarts=10, processes=4, chunk_size=None, bounds=((0., 1.), (0., 10.)), seed=None,
+        max_iterations=100, tolerance=1e-6, **model):
+    """
+    Maximum likelihood estimates of alpha and beta for every participant, starting the optimization from the best
+    point of a coarse grid and from n_restarts - 1 random points within bounds, in chunks of chunk_size participants
+    (by default, one chunk per process) run in parallel (if processes > 1).
+    Returns a dataframe with participant, alpha, beta, log_likelihood, n_choices and bic.
+    """
+    rng = np.random.RandomState(seed)
+    n_participants = len(task['participants'])
+    low, high = np.array(bounds).T
+    starts = low + (high - low)*rng.uniform(size=(n_participants, n_restarts, 2))
+    grid, _ = grid_search(task, np.linspace(low[0], high[0], 11), np.linspace(low[1], high[1], 11), **model)
+    starts[:, 0] = grid[['alpha', 'beta']].values
+
+    if chunk_size is None:
+        chunk_size = int(np.ceil(n_participants/max(processes, 1)))
+    chunks = [np.arange(start, min(start + chunk_size, n_participants)) for start in range(0, n_participants, chunk_size)]
+    jobs = [(_select(task, index), starts[index], bounds, model, max_iterations, tolerance) for index in chunks]
+    if processes > 1:
+        pool = Pool(processes)
+        results = pool.map(_fit_chunk, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = [_fit_chunk(job) for job in jobs]
+
+    x = np.concatenate([r[0] for r in results])
+    loglik = np.concatenate([r[1] for r in results])
+    best = np.argmax(loglik, axis=1)
+    index = np.arange(n_participants)
+    n_choices = (task['choice'] >= 0).sum(axis=1)
+    fits = pd.DataFrame({'participant': task['participants'], 'alpha': x[index, best, 0], 'beta': x[index, best, 1],
+                         'log_likelihood': loglik[index, best], 'n_choices': n_choices})
+    fits['bic'] = 2*np.log(np.maximum(n_choices, 1)) - 2*fits['log_likelihood']
+    return fits
+
+def main():
+    parser = argparse.ArgumentParser(description='Fits a Q-learning model to the data of example 4.')
+    parser.add_argument('files', nargs='+', help='.csv files of example 4')
+    parser.add_argument('--restarts', type=int, default=10)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--full-feedback', action='store_true')
+    parser.add_argument('--q0', type=float, default=0.)
+    parser.add_argument('--output', default=None, help='.csv file for the estimates')
+    args = parser.parse_args()
+
+    task = prepare(pd.concat([pd.read_csv(f) for f in args.files], ignore_index=True))
+    fits = fit(task, n_restarts=args.restarts, processes=args.processes, q0=args.q0, full_feedback=args.full_feedback)
+    if args.output is not None:
+        fits.to_csv(args.output, index=False)
+    print(fits)
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
-from psychopy import core, event, logging
+from psychopy import core, logging
+from collections import OrderedDict
+import itertools
 import numpy as np
 
 """
@@ -7,48 +9,461 @@ We have 4 ways of running a routine:
 2) stop when a response (among possible ones) is given
 3) stop when a response (among possible ones) is given or a certain amount of time is expired
 4) for a certain amount of time, and also record the first response given (among possible ones)
+and, for mouse-tracking, a 5th: stop when the pointer enters one of some regions (or a certain amount of time is expired).
+All of them can also return every key press (record_keys=True) and the pointer position at every flip (record_mouse=True).
 """
 
+class FrameRecorder(object):
+    """
+    Records the timestamp of every window flip in a preallocated buffer, and keeps
+    track of which flips belong to which event (by label).
+    At the end of every event it computes the flip-interval stats and the number of dropped frames:
+    an interval counts as round(interval/frame_period)-1 dropped frames when it is longer than 1.5 frame periods.
+    """
+    def __init__(self, frames_per_second, max_frames=2**18):
+        self.frame_period = 1./frames_per_second
+        self.flip_times = np.full(max_frames, np.nan) # preallocated, grows (doubling) only if full
+        self.n_flips = 0
+        self.events = [] # one dict of stats per event
+        self._event_label = None
+        self._event_start = 0
+        self._event_n_frames = None
+
+    def start_event(self, label, n_frames=None):
+        self._event_label = label
+        self._event_start = self.n_flips
+        self._event_n_frames = n_frames
+
+    def record(self, flip_time):
+        if self.n_flips == len(self.flip_times):
+            self.flip_times = np.append(self.flip_times, np.full(len(self.flip_times), np.nan))
+        self.flip_times[self.n_flips] = flip_time
+        self.n_flips += 1
+
+    def stop_event(self):
+        times = self.flip_times[self._event_start:self.n_flips]
+        intervals = np.diff(times)
+        n_periods = np.round(intervals/self.frame_period)
+        dropped = intervals > 1.5*self.frame_period
+        stats = {
+            'label': self._event_label,
+            'start': self._event_start,
+            'stop': self.n_flips,
+            'n_frames': len(times),
+            'n_frames_requested': self._event_n_frames,
+            'duration': (times[-1] - times[0] + self.frame_period) if len(times) > 0 else 0.,
+            'interval_mean': intervals.mean() if len(intervals) > 0 else np.nan,
+            'interval_sd': intervals.std() if len(intervals) > 0 else np.nan,
+            'interval_min': intervals.min() if len(intervals) > 0 else np.nan,
+            'interval_max': intervals.max() if len(intervals) > 0 else np.nan,
+            'dropped_frames': int(np.sum(n_periods[dropped] - 1)),
+        }
+        self.events.append(stats)
+        self._event_label = None
+        return stats
+
+    def get_flip_times(self, label=None):
+        """Returns the flip timestamps of all events (or only of the events with a certain label)."""
+        if label is None:
+            return self.flip_times[:self.n_flips]
+        return [self.flip_times[ev['start']:ev['stop']] for ev in self.events if ev['label'] == label]
+
+    def get_events(self, label=None):
+        """Returns the stats of all events (or only of the events with a certain label)."""
+        return [ev for ev in self.events if label is None or ev['label'] == label]
+
+    def save(self, file_name):
+        """Saves the flip timestamps and the per-event stats of the session in file_name + '.npz'."""
+        columns = {}
+        for key in ['label', 'start', 'stop', 'n_frames', 'n_frames_requested', 'duration',
+                    'interval_mean', 'interval_sd', 'interval_min', 'interval_max', 'dropped_frames']:
+            values = [ev[key] for ev in self.events]
+            if key == 'n_frames_requested':
+                values = [np.nan if v is None else v for v in values]
+            columns[key] = np.array(values)
+        np.savez(file_name + '.npz', flip_times=self.flip_times[:self.n_flips], frame_period=self.frame_period, **columns)
+
+KEY_PRESS = np.dtype([('key', 'U32'), ('down', 'f8'), ('up', 'f8')])
+MOUSE_SAMPLE = np.dtype([('time', 'f8'), ('x', 'f8'), ('y', 'f8')])
+
+def hit_rectangles(regions):
+    """
+    Returns the (left, bottom, right, top) rectangle of every region: a component (from its pos and size,
+    or boundingBox for text, in the units of the window) or already a (left, bottom, right, top) tuple.
+    """
+    rectangles = np.empty((len(regions), 4))
+    for i, region in enumerate(regions):
+        if hasattr(region, 'pos'):
+            size = getattr(region, 'size', None)
+            if size is None or np.ndim(size) == 0:
+                size = region.boundingBox
+            x, y = region.pos
+            width, height = np.abs(size)
+            rectangles[i] = x - width/2., y - height/2., x + width/2., y + height/2.
+        else:
+            rectangles[i] = region
+    return rectangles
+
 class Routine(object):
-    def __init__(self, window, frames_per_second, escape_key):
+    def __init__(self, window, frames_per_second, escape_key, frame_recorder=None, timer=None, events=None,
+                 deadline_timing=False, max_drift=.5, cache_static=False, max_layers=32, log_sink=None, max_key_presses=64,
+                 mouse=None, max_mouse_samples=2**12):
         self.frames_per_second = frames_per_second
+        self.frame_period = 1./frames_per_second
         self.escape_key = escape_key
         self.window = window
-        self.timer = core.Clock()
+        self.timer = core.Clock() if timer is None else timer
+        if events is None:
+            from psychopy import event # only imported here, as it needs a display (not needed with the headless stand-ins)
+            events = event
+        self.events = events # where keys are read from (psychopy.event, or a stand-in with the same getKeys/clearEvents functions)
+        self.frame_recorder = frame_recorder # optional FrameRecorder, to keep track of every flip
+        self.log_sink = log_sink # optional LogSink, where the events are logged instead of the PsychoPy log file
+        self._on_flip_messages = [] # messages for the log_sink, logged at the next flip
 
-    def wait_for_time_limit(self, components, time_seconds, label):
-        n_frames = int(np.round(self.frames_per_second*time_seconds)) # define number of frames
-        event.clearEvents() # clear event cache
-        self.window.logOnFlip(level=logging.EXP, msg='%s onset' % label) # log onset stimuli
+        # all the key presses (and releases) of an event, when record_keys=True (at most max_key_presses per event)
+        self._key_presses = np.zeros(max_key_presses, dtype=KEY_PRESS)
+        self._n_key_presses = 0
+        self._get_releases = None
+
+        # the pointer position at every flip of an event, when record_mouse=True (at most max_mouse_samples per event)
+        self.mouse = mouse # psychopy.event.Mouse (created when first needed), or a stand-in with the same getPos/setPos functions
+        self._mouse_samples = np.zeros(max_mouse_samples, dtype=MOUSE_SAMPLE)
+        self._n_mouse_samples = 0
+
+        # deadline timing: timed events end at an absolute deadline (see _flip), and the delays are carried over to the next events
+        self.deadline_timing = deadline_timing
+        self.max_drift = max_drift # if an event starts later than this after the previous deadline, the deadlines start again from its onset
+        self.drifts = [] # (label, drift in seconds) for every timed event
+        self._deadline = None
+        self._event_seconds = None
+        self._stop_time = np.inf
+        self._last_flip = None
+
+        # static layers: the components at the bottom of an event that do not change are drawn once into a single image
+        self.cache_static = cache_static
+        self.max_layers = max_layers
+        self._dynamic = set() # ids of the components that change within an event
+        self._layers = OrderedDict() # ids of the static components -> (layer, static components)
+
+    def set_dynamic(self, *components):
+        """Marks components that change while they are shown (e.g., moving), so that they are always drawn live."""
+        for comp in components:
+            self._dynamic.add(id(comp))
+
+    def compose(self, components):
+        """
+        Returns the components to draw in an event: the static components at the bottom (all the ones before the first dynamic one)
+        are replaced by a single image of them, created the first time that they are shown together.
+        Static components should not change after that (or clear_layers should be called).
+        """
+        if not self.cache_static:
+            return components
+        n_static = 0
+        for comp in components:
+            if id(comp) in self._dynamic:
+                break
+            n_static += 1
+        if n_static < 2:
+            return components
+
+        key = tuple(id(comp) for comp in components[:n_static])
+        if key in self._layers:
+            self._layers.move_to_end(key)
+            layer = self._layers[key][0]
+        else:
+            from psychopy.visual import BufferImageStim # only imported here, as it needs an OpenGL window
+            layer = BufferImageStim(self.window, stim=list(components[:n_static]))
+            self._layers[key] = (layer, list(components[:n_static])) # keep the components so that their ids are not reused
+            if len(self._layers) > self.max_layers:
+                self._layers.popitem(last=False)
+        return [layer] + list(components[n_static:])
+
+    def clear_layers(self):
+        self._layers.clear()
+
+    def measure_refresh(self, n_frames=120, n_warmup=10):
+        """
+        Measures the refresh period of the monitor (median interval between n_frames flips),
+        and uses it instead of frames_per_second from now on.
+        """
+        for frameN in range(n_warmup):
+            self.window.flip()
+        flip_times = np.empty(n_frames)
+        for frameN in range(n_frames):
+            flip_time = self.window.flip()
+            flip_times[frameN] = core.getTime() if flip_time is None else flip_time
+        self.frame_period = np.median(np.diff(flip_times))
+        self.frames_per_second = 1./self.frame_period
+        self._last_flip = flip_times[-1]
+        self._log(logging.EXP, 'measured refresh rate: %.3f Hz', self.frames_per_second)
+        return self.frame_period
+
+    def warm_up(self, components=(), images=(), image_cache=None, image_size=None, image_pos=(0, 0), n_flips=30, start_time=None):
+        """
+        Does before the first trial what would otherwise slow down the first events of the session:
+        - draws every component (stimuli, or TextPools) and every image (at image_pos, or at each of a list of positions)
+          once in the back buffer, which is then cleared (fonts, textures and shaders are loaded at the first draw);
+          the images are taken from image_cache if given
+        - reads the keyboard, the clock and the logging once, and runs n_flips timed flips
+        Returns (and logs) the time spent in startup (from start_time, by default the import of psychopy, to the warm-up)
+        and in the warm-up, with the slowest first draw and the longest flip interval.
+        """
+        warm_up_start = core.getTime()
+        if start_time is None:
+            start_time = warm_up_start - logging.defaultClock.getTime()
+
+        stims = []
+        for comp in components:
+            stims.extend(comp if hasattr(comp, '__len__') and not hasattr(comp, 'draw') else [comp])
+        if len(images) > 0 and image_cache is None:
+            from psychopy.visual import ImageStim
+        positions = image_pos if np.ndim(image_pos) == 2 else [image_pos]
+        for path in images:
+            for pos in positions:
+                if image_cache is not None:
+                    stims.append(image_cache.get_stim(path, size=image_size, pos=tuple(pos)))
+                else:
+                    stims.append(ImageStim(win=self.window, image=path, size=image_size, pos=pos))
+
+        slowest_draw, slowest_name = 0., None
+        for stim in stims:
+            t = core.getTime()
+            stim.draw()
+            if core.getTime() - t > slowest_draw:
+                slowest_draw, slowest_name = core.getTime() - t, getattr(stim, 'name', None)
+        self.window.clearBuffer()
+
+        self.events.clearEvents()
+        self.events.getKeys(keyList=[self.escape_key], timeStamped=self.timer)
+        self.timer.reset()
+        self.timer.getTime()
+        self._log(logging.DEBUG, 'warm-up start')
+
+        flip_times = np.empty(n_flips)
+        for frameN in range(n_flips):
+            flip_time = self.window.flip()
+            flip_times[frameN] = core.getTime() if flip_time is None else flip_time
+        self.events.clearEvents()
+        self._last_flip = flip_times[-1] if n_flips > 0 else self._last_flip
+
+        report = {'startup': warm_up_start - start_time, 'warm_up': core.getTime() - warm_up_start, 'n_stimuli': len(stims),
+                  'slowest_draw': slowest_draw, 'slowest_stimulus': slowest_name,
+                  'max_flip_interval': np.max(np.diff(flip_times)) if n_flips > 1 else np.nan}
+        self._log(logging.EXP, 'warm-up: startup %.3f s, warm-up %.3f s (%d stimuli, slowest first draw %.1f ms, longest flip interval %.1f ms)',
+            report['startup'], report['warm_up'], report['n_stimuli'], 1000*report['slowest_draw'], 1000*report['max_flip_interval'])
+        return report
+
+    def _log(self, level, msg, *values):
+        # the numbers that change are given as values (msg is their format), so that the log_sink does not store a new message every time
+        if self.log_sink is not None:
+            self.log_sink.write(self._last_flip, level, msg, *values)
+        else:
+            logging.log(level=level, msg=msg % values if values else msg)
+
+    def _log_on_flip(self, level, msg):
+        if self.log_sink is not None:
+            self._on_flip_messages.append((level, msg))
+        else:
+            self.window.logOnFlip(level=level, msg=msg)
+
+    def _log_keypress(self, key):
+        if self.log_sink is not None:
+            self.log_sink.write(self._last_flip, logging.DATA, 'Keypress: %s' % key)
+
+    def _start_recording_keys(self):
+        self._n_key_presses = 0
+        self._get_releases = getattr(self.events, 'getReleases', None) # not all the backends give the key releases
+
+    def _record_keys(self, pressed_keys, key_list):
+        for key, rt in pressed_keys:
+            if key != self.escape_key and self._n_key_presses < len(self._key_presses):
+                self._key_presses[self._n_key_presses] = (key, rt, np.nan)
+                self._n_key_presses += 1
+        if self._get_releases is not None:
+            for key, rt in self._get_releases(keyList=key_list, timeStamped=self.timer):
+                # the release belongs to the last press of the same key that is still down
+                for i in range(self._n_key_presses - 1, -1, -1):
+                    if self._key_presses['key'][i] == key and np.isnan(self._key_presses['up'][i]):
+                        self._key_presses['up'][i] = rt
+                        break
+
+    def _recorded_keys(self):
+        # copy of the key presses of the event, with down and up times (np.nan if not released during the event) from the onset
+        return self._key_presses[:self._n_key_presses].copy()
+
+    def _start_recording_mouse(self, start_pos=None):
+        if self.mouse is None:
+            from psychopy.event import Mouse
+            self.mouse = Mouse(win=self.window)
+        if start_pos is not None:
+            self.mouse.setPos(start_pos)
+        self._n_mouse_samples = 0
+
+    def _record_mouse(self):
+        # written in place, so that nothing is allocated at every flip
+        x, y = self.mouse.getPos()
+        i = self._n_mouse_samples
+        if i < len(self._mouse_samples):
+            self._mouse_samples[i] = (self.timer.getTime(), x, y)
+            self._n_mouse_samples += 1
+        return x, y
+
+    def _recorded_mouse(self):
+        # copy of the pointer positions of the event, with their times from the onset
+        return self._mouse_samples[:self._n_mouse_samples].copy()
+
+    def _recorded(self, key_rt, record_keys, record_mouse):
+        if record_keys:
+            key_rt = key_rt + (self._recorded_keys(),)
+        if record_mouse:
+            key_rt = key_rt + (self._recorded_mouse(),)
+        return key_rt
+
+    def reset_deadlines(self):
+        """The next timed event starts its deadline from its own onset (e.g., after a break)."""
+        self._deadline = None
+
+    def _onset(self, label, n_frames=None, time_seconds=None):
+        self.events.clearEvents() # clear event cache
+        self._log_on_flip(logging.EXP, '%s onset' % label) # log onset stimuli
         self.window.callOnFlip(self.timer.reset)
+        if self.frame_recorder is not None:
+            self.frame_recorder.start_event(label, n_frames)
+        if self.deadline_timing and time_seconds is not None:
+            self._event_seconds = time_seconds # the deadline is set at the first flip
+        if self.log_sink is not None:
+            self.log_sink.busy = True
+
+    def _flip(self):
+        flip_time = self.window.flip()
+        if flip_time is None:
+            flip_time = core.getTime()
+        if self.frame_recorder is not None:
+            self.frame_recorder.record(flip_time)
+        self._last_flip = flip_time
+        if self._on_flip_messages:
+            for level, msg in self._on_flip_messages:
+                self.log_sink.write(flip_time, level, msg)
+            del self._on_flip_messages[:]
+
+        if self._event_seconds is not None:
+            # first flip of a timed event: it ends time_seconds after the previous deadline (or after its onset)
+            if self._deadline is None or flip_time - self._deadline > self.max_drift:
+                self._deadline = flip_time
+            self._deadline += self._event_seconds
+            self._stop_time = self._deadline - 1.5*self.frame_period # stop after this flip, so that the next one is at the deadline
+            self._event_seconds = None
+        return flip_time
+
+    def _offset(self, label, timed=True):
+        self._log_on_flip(logging.EXP, '%s offset' % label) # log offset stimuli
+        if self.frame_recorder is not None:
+            stats = self.frame_recorder.stop_event()
+            requested = np.nan if stats['n_frames_requested'] is None else stats['n_frames_requested'] # nan when not timed
+            self._log(logging.EXP, '%s frames: %%d (requested: %%.0f), dropped: %%d' % label.replace('%', '%%'),
+                      stats['n_frames'], requested, stats['dropped_frames'])
+        if self.deadline_timing:
+            if self._event_seconds is not None or self._last_flip is None:
+                # no flip in this event (shorter than half a frame): no deadline was set, and none is carried over
+                self._event_seconds = None
+            elif timed:
+                if self._deadline is not None:
+                    drift = self._last_flip + self.frame_period - self._deadline # from the expected time of the next flip
+                    self.drifts.append((label, drift))
+                    self._log(logging.EXP, '%s drift: %%.1f ms' % label.replace('%', '%%'), 1000*drift)
+            else: # ended by a response: the next deadlines start from here
+                self._deadline = self._last_flip + self.frame_period
+            self._stop_time = np.inf
+        if self.log_sink is not None:
+            self.log_sink.busy = False
+
+    # public hooks, to run the events in another frame loop (see Timeline)
+    def start_event(self, label, n_frames=None, time_seconds=None):
+        """Starts an event at the next flip: onset log, timer reset, frame recorder and deadline (time_seconds, if timed)."""
+        self._onset(label, n_frames, time_seconds)
+
+    def flip(self):
+        """Flips the window and returns the time of the flip."""
+        return self._flip()
+
+    def event_expired(self, flip_time):
+        """True if the timed event should end after this flip, so that the next flip is at its deadline (with deadline_timing)."""
+        return flip_time >= self._stop_time
+
+    def log_keypress(self, key):
+        """Logs a key press in the log_sink, if given (otherwise PsychoPy logs the key presses itself)."""
+        self._log_keypress(key)
+
+    def end_event(self, label, timed=True):
+        """Ends the event: offset log at the next flip, frame stats and drift (timed is False if it was ended by a response)."""
+        self._offset(label, timed)
+
+    def _run_frames(self, frames):
+        # runs the frame loop of an event (a generator that yields after every frame, see AsyncRoutine), returns its results
+        while True:
+            try:
+                next(frames)
+            except StopIteration as stop:
+                return stop.value
+
+    def wait_for_time_limit(self, components, time_seconds, label, record_mouse=False):
+        return self._run_frames(self._wait_for_time_limit(components, time_seconds, label, record_mouse))
+
+    def _wait_for_time_limit(self, components, time_seconds, label, record_mouse=False):
+        components = self.compose(components)
+        n_frames = int(np.round(self.frames_per_second*time_seconds)) # define number of frames
+        self._onset(label, n_frames, time_seconds)
+        if record_mouse:
+            self._start_recording_mouse()
 
         for frameN in range(n_frames):
             for comp in components:
                 comp.draw()
-            self.window.flip()
+            flip_time = self._flip()
+            if record_mouse:
+                self._record_mouse()
 
-            pressed_keys = event.getKeys(keyList=[self.escape_key])
+            pressed_keys = self.events.getKeys(keyList=[self.escape_key])
             if len(pressed_keys)>0:
                 self.window.close()
                 core.quit()
 
-        self.window.logOnFlip(level=logging.EXP, msg='%s offset' % label) # log offset stimuli
+            if flip_time >= self._stop_time:
+                break
+
+            yield # the next frame
+
+        self._offset(label)
+        if record_mouse:
+            return time_seconds, self._recorded_mouse()
         return time_seconds
 
-    def wait_for_keys(self, components, valid_keys, label):
-        event.clearEvents() # clear event cache
-        self.window.logOnFlip(level=logging.EXP, msg='%s onset' % label) # log onset stimuli
-        self.window.callOnFlip(self.timer.reset)
+    def wait_for_keys(self, components, valid_keys, label, record_keys=False, record_mouse=False):
+        return self._run_frames(self._wait_for_keys(components, valid_keys, label, record_keys, record_mouse))
+
+    def _wait_for_keys(self, components, valid_keys, label, record_keys=False, record_mouse=False):
+        components = self.compose(components)
+        self._onset(label)
         key_list = np.append(valid_keys, self.escape_key)
+        if record_keys:
+            self._start_recording_keys()
+        if record_mouse:
+            self._start_recording_mouse()
 
         while True:
             for comp in components:
                 comp.draw()
-            self.window.flip()
+            self._flip()
+            if record_mouse:
+                self._record_mouse()
 
-            pressed_keys = event.getKeys(keyList=key_list, timeStamped=self.timer)
+            pressed_keys = self.events.getKeys(keyList=key_list, timeStamped=self.timer)
+            if record_keys:
+                self._record_keys(pressed_keys, key_list)
             if len(pressed_keys)>0:
                 key, rt = pressed_keys[0] # get the first pressed key and response time
+                self._log_keypress(key)
 
                 if key == self.escape_key:
                     self.window.close()
@@ -56,24 +471,37 @@ class Routine(object):
                 else:
                     break
 
-        self.window.logOnFlip(level=logging.EXP, msg='%s offset' % label) # log offset stimuli
-        return key, rt
+            yield # the next frame
+
+        self._offset(label, timed=False)
+        return self._recorded((key, rt), record_keys, record_mouse)
 
-    def wait_for_keys_or_time_limit(self, components, valid_keys, time_seconds, label):
+    def wait_for_keys_or_time_limit(self, components, valid_keys, time_seconds, label, record_keys=False, record_mouse=False):
+        return self._run_frames(self._wait_for_keys_or_time_limit(components, valid_keys, time_seconds, label, record_keys, record_mouse))
+
+    def _wait_for_keys_or_time_limit(self, components, valid_keys, time_seconds, label, record_keys=False, record_mouse=False):
+        components = self.compose(components)
         n_frames = int(np.round(self.frames_per_second*time_seconds)) # define number of frames
-        event.clearEvents() # clear event cache
-        self.window.logOnFlip(level=logging.EXP, msg='%s onset' % label) # log onset stimuli
-        self.window.callOnFlip(self.timer.reset)
+        self._onset(label, n_frames, time_seconds)
         key_list = np.append(valid_keys, self.escape_key)
+        if record_keys:
+            self._start_recording_keys()
+        if record_mouse:
+            self._start_recording_mouse()
 
         for frameN in range(n_frames):
             for comp in components:
                 comp.draw()
-            self.window.flip()
+            flip_time = self._flip()
+            if record_mouse:
+                self._record_mouse()
 
-            pressed_keys = event.getKeys(keyList=key_list, timeStamped=self.timer)
+            pressed_keys = self.events.getKeys(keyList=key_list, timeStamped=self.timer)
+            if record_keys:
+                self._record_keys(pressed_keys, key_list)
             if len(pressed_keys)>0:
                 key, rt = pressed_keys[0] # get the first pressed key and response time
+                self._log_keypress(key)
 
                 if key == self.escape_key:
                     self.window.close()
@@ -81,34 +509,114 @@ class Routine(object):
                 else:
                     break
 
-        self.window.logOnFlip(level=logging.EXP, msg='%s offset' % label) # log offset stimuli
+            if flip_time >= self._stop_time:
+                break
+
+            yield # the next frame
+
+        self._offset(label, timed=len(pressed_keys)==0)
         if len(pressed_keys)>0:
-             return key, rt
+             key_rt = key, rt
         else:
-             return np.nan, time_seconds
+             key_rt = np.nan, time_seconds
+        return self._recorded(key_rt, record_keys, record_mouse)
 
-    def wait_for_time_limit_first_key(self, components, valid_keys, time_seconds, label):
+    def wait_for_time_limit_first_key(self, components, valid_keys, time_seconds, label, record_keys=False, record_mouse=False):
+        return self._run_frames(self._wait_for_time_limit_first_key(components, valid_keys, time_seconds, label, record_keys, record_mouse))
+
+    def _wait_for_time_limit_first_key(self, components, valid_keys, time_seconds, label, record_keys=False, record_mouse=False):
+        components = self.compose(components)
         n_frames = int(np.round(self.frames_per_second*time_seconds)) # define number of frames
-        event.clearEvents() # clear event cache
-        self.window.logOnFlip(level=logging.EXP, msg='%s onset' % label) # log onset stimuli
-        self.window.callOnFlip(self.timer.reset)
+        self._onset(label, n_frames, time_seconds)
         key_list = np.append(valid_keys, self.escape_key)
+        first_key = None
+        if record_keys:
+            self._start_recording_keys()
+        if record_mouse:
+            self._start_recording_mouse()
 
         for frameN in range(n_frames):
             for comp in components:
                 comp.draw()
-            self.window.flip()
+            flip_time = self._flip()
+            if record_mouse:
+                self._record_mouse()
 
-            pressed_keys = event.getKeys(keyList=key_list, timeStamped=self.timer)
+            pressed_keys = self.events.getKeys(keyList=key_list, timeStamped=self.timer)
+            if record_keys:
+                self._record_keys(pressed_keys, key_list)
             if len(pressed_keys)>0:
                 key, rt = pressed_keys[0] # get the first pressed key and response time
+                self._log_keypress(key)
 
                 if key == self.escape_key:
                     self.window.close()
                     core.quit()
+                elif first_key is None:
+                    first_key = key, rt # keep the first response, also if other keys are pressed later
 
-        self.window.logOnFlip(level=logging.EXP, msg='%s offset' % label) # log offset stimuli
-        if len(pressed_keys)>0:
-             return key, rt
+            if flip_time >= self._stop_time:
+                break
+
+            yield # the next frame
+
+        self._offset(label)
+        if first_key is not None:
+             key_rt = first_key
+        else:
+             key_rt = np.nan, time_seconds
+        return self._recorded(key_rt, record_keys, record_mouse)
+
+    def wait_for_region(self, components, regions, label, time_seconds=None, start_pos=None, record_mouse=False):
+        """
+        Stops when the pointer enters one of the regions (components, or (left, bottom, right, top) rectangles, see hit_rectangles),
+        or after time_seconds (if given). The pointer is first moved to start_pos (if given).
+        Returns the index of the region that was entered and the time from the onset (np.nan and time_seconds on timeout).
+        """
+        return self._run_frames(self._wait_for_region(components, regions, label, time_seconds, start_pos, record_mouse))
+
+    def _wait_for_region(self, components, regions, label, time_seconds=None, start_pos=None, record_mouse=False):
+        components = self.compose(components)
+        rectangles = hit_rectangles(regions).tolist() # computed once: only compared with the pointer in the frame loop
+        if time_seconds is None:
+            n_frames, frames = None, itertools.count() # no time limit
+        else:
+            n_frames = int(np.round(self.frames_per_second*time_seconds)) # define number of frames
+            frames = range(n_frames)
+        self._onset(label, n_frames, time_seconds)
+        self._start_recording_mouse(start_pos)
+        region = None
+
+        for frameN in frames:
+            for comp in components:
+                comp.draw()
+            flip_time = self._flip()
+            if record_mouse:
+                x, y = self._record_mouse()
+            else:
+                x, y = self.mouse.getPos()
+
+            pressed_keys = self.events.getKeys(keyList=[self.escape_key])
+            if len(pressed_keys)>0:
+                self.window.close()
+                core.quit()
+
+            for i, (left, bottom, right, top) in enumerate(rectangles):
+                if left <= x <= right and bottom <= y <= top:
+                    region = i, self.timer.getTime()
+                    break
+            if region is not None:
+                self._log(logging.DATA, 'Region: %d', region[0])
+                break
+
+            if flip_time >= self._stop_time:
+                break
+
+            yield # the next frame
+
+        self._offset(label, timed=region is None)
+        if region is not None:
+             key_rt = region
         else:
-             return np.nan, time_seconds
+             key_rt = np.nan, time_seconds
+        return self._recorded(key_rt, False, record_mouse)
@@ -0,0 +1,92 @@
+from __future__ import division
+import numpy as np
+
+"""
+Generates the trial orders of many participants at once, with constraints:
+- groups: trials are shuffled only within groups (e.g., difficulty levels), and the groups follow each other in order,
+  which can change across participants (e.g., easy to hard for odd participants and hard to easy for even ones)
+- max_run: no more than max_run consecutive trials of the same category
+- balanced_transitions: every pair of consecutive categories occurs about the same number of times
+
+Orders are drawn for all participants together (one row per participant), and the rows that do not satisfy
+the constraints are drawn again. The orders can be saved in a schedule file, from which
+a single participant's orders are read at the beginning of the session without loading the whole file.
+"""
+
+def counterbalanced_ranks(groups, group_orders, participants):
+    """
+    Rank of the group of every trial, for every participant (one row per participant):
+    participant p follows group_orders[(p - 1) % len(group_orders)], so with two orders,
+    odd participants follow the first one and even participants the second one.
+    """
+    groups = np.asarray(groups)
+    participants = np.asarray(participants)
+    ranks = np.empty((len(group_orders), len(groups)), dtype=np.int32)
+    for i, order in enumerate(group_orders):
+        ranks[i] = [list(order).index(group) for group in groups]
+    return ranks[(participants - 1) % len(group_orders)]
+
+def run_too_long(sequences, max_run):
+    """For every row, True if some category is repeated more than max_run times in a row."""
+    same = np.zeros((sequences.shape[0], sequences.shape[1]), dtype=np.int32)
+    same[:, 1:] = sequences[:, 1:] == sequences[:, :-1]
+    # the length of the run ending at each trial is more than max_run if the max_run previous trials are all repetitions
+    cumulative = np.cumsum(same, axis=1)
+    windows = cumulative[:, max_run - 1:] - np.concatenate([np.zeros((same.shape[0], 1), dtype=np.int32), cumulative[:, :-max_run]], axis=1)
+    return np.any(windows >= max_run, axis=1)
+
+def transition_counts(sequences, n_categories):
+    """Number of times each transition between categories (from*n_categories + to) occurs, for every row."""
+    n_rows = sequences.shape[0]
+    codes = sequences[:, :-1]*n_categories + sequences[:, 1:] + np.arange(n_rows)[:, np.newaxis]*n_categories**2
+    return np.bincount(codes.ravel(), minlength=n_rows*n_categories**2).reshape(n_rows, n_categories**2)
+
+def shuffled_orders(n_participants, n_trials, group_ranks=None, categories=None, max_run=None,
+                    balanced_transitions=False, tolerance=1, seed=None, max_attempts=10000):
+    """
+    Returns an array (n_participants x n_trials) with the order of the trials (indexes from 0 to n_trials-1) for every participant.
+    group_ranks: rank of the group of each trial (one row, or one row per participant); trials are shuffled within groups
+    categories: category of each trial (needed for max_run and balanced_transitions)
+    tolerance: maximum difference between the most and the least frequent transition
+    """
+    rng = np.random.RandomState(seed)
+    if categories is not None:
+        category_names, category_codes = np.unique(categories, return_inverse=True)
+    if group_ranks is not None:
+        group_ranks = np.broadcast_to(np.asarray(group_ranks), (n_participants, n_trials))
+
+    orders = np.empty((n_participants, n_trials), dtype=np.int32)
+    todo = np.arange(n_participants)
+    for attempt in range(max_attempts):
+        keys = rng.uniform(size=(len(todo), n_trials))
+        if group_ranks is not None:
+            keys += group_ranks[todo]
+        new_orders = np.argsort(keys, axis=1)
+
+        valid = np.ones(len(todo), dtype=bool)
+        if categories is not None and (max_run is not None or balanced_transitions):
+            sequences = category_codes[new_orders]
+            if max_run is not None:
+                valid &= ~run_too_long(sequences, max_run)
+            if balanced_transitions:
+                counts = transition_counts(sequences, len(category_names))
+                valid &= (counts.max(axis=1) - counts.min(axis=1)) <= tolerance
+
+        orders[todo[valid]] = new_orders[valid]
+        todo = todo[~valid]
+        if len(todo) == 0:
+            return orders
+    raise ValueError('The constraints could not be satisfied for %d participants in %d attempts' % (len(todo), max_attempts))
+
+def save_schedule(file_name, orders):
+    """
+    Saves the orders of all participants (an array n_participants x n_trials, or n_participants x n_blocks x n_trials),
+    participant 1 being the first row.
+    """
+    orders = np.asarray(orders)
+    dtype = np.int16 if orders.max() < 2**15 else np.int32
+    np.save(file_name, orders.astype(dtype))
+
+def load_schedule(file_name, participant):
+    """Returns the orders of one participant (reading only its row of the file)."""
+    return np.array(np.load(file_name, mmap_mode='r')[participant - 1])
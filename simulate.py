@@ -0,0 +1,236 @@
+from __future__ import division
+import numpy as np
+import pandas as pd
+
+from sequences import counterbalanced_ranks, shuffled_orders
+
+"""
+Simulates many participants (agents) doing the tasks of the four examples, without PsychoPy, for power analyses
+and checks of the designs. The trials are generated as in the example scripts, and all the agents of a batch
+do the same trial together (one row per agent), so that 10^4-10^6 agents take seconds to minutes.
+
+The result has the same columns as the .csv files written by the examples (trial columns in alphabetical order,
+then the session information), so it can be analysed with the same code:
+
+    data = pd.concat(simulate('example_4', n_agents=10000, seed=1, alpha=np.random.uniform(0, 1, 10000), beta=.2))
+
+The agents choose with choice_rule (softmax_choice by default) from the strength of the evidence for the second option
+(the right one, or the second valid key) and respond with times given by rt_model (LognormalRT by default).
+Responses slower than the time limit of the task are missing (choice nan, rt = time limit), as in the examples.
+The parameters of the agents (beta, rho, alpha, ...) can be scalars or arrays with one value per agent.
+"""
+
+EXP_INFO = ['participant', 'age', 'gender', 'hand', 'date', 'expName'] # session columns, in the order of expInfo
+
+def softmax_choice(rng, strength, beta, lapse=0.):
+    """True if the second option is chosen, with probability 1/(1 + exp(-beta*strength)) (random choice with probability lapse)."""
+    p = 1/(1 + np.exp(-beta*strength))
+    p = lapse/2 + (1 - lapse)*p
+    return rng.uniform(size=p.shape) < p
+
+class LognormalRT(object):
+    """Response times with a lognormal distribution, not depending on the choice."""
+    def __init__(self, median=.8, sigma=.3):
+        self.median = median
+        self.sigma = sigma
+
+    def __call__(self, rng, strength):
+        return self.median*np.exp(self.sigma*rng.normal(size=np.shape(strength)))
+
+class ChronometricRT(object):
+    """Slower responses for harder choices: the median is non_decision + scale/(1 + |strength|), with lognormal noise."""
+    def __init__(self, non_decision=.3, scale=1., sigma=.3):
+        self.non_decision = non_decision
+        self.scale = scale
+        self.sigma = sigma
+
+    def __call__(self, rng, strength):
+        decision = self.scale/(1 + np.abs(strength))
+        return self.non_decision + decision*np.exp(self.sigma*rng.normal(size=np.shape(strength)))
+
+def _respond(rng, strength, beta, choice_rule, rt_model, time_limit=None):
+    # choice (True for the second option), response time and whether the agent responded in time
+    second = choice_rule(rng, strength, beta)
+    rt = rt_model(rng, beta*strength)
+    responded = np.ones(rt.shape, dtype=bool) if time_limit is None else rt < time_limit
+    if time_limit is not None:
+        rt = np.where(responded, rt, time_limit)
+    return second, rt, responded
+
+def _keys(second, responded, choice_keys):
+    keys = np.where(second, choice_keys[1], choice_keys[0]).astype(object)
+    keys[~responded] = np.nan # missing response, as in the .csv files
+    return keys
+
+def _column(value, n_agents):
+    # per agent parameter, as a column to broadcast over the trials
+    return np.reshape(np.broadcast_to(value, (n_agents,)), (n_agents, 1)).astype(float)
+
+def simulate_example_1(n_agents, rng, beta=10., rho=1., choice_rule=softmax_choice, rt_model=None, choice_keys=('q', 'p'),
+                       time_limit=5):
+    """
+    Sure gains (right, second key) against a 50% chance of winning 600 (left): the utility of x is (x/600)**rho,
+    and the strength for the sure gain is its utility minus the one of the gamble (.5).
+    """
+    rt_model = LognormalRT() if rt_model is None else rt_model
+    rewards = np.arange(0, 601, 30)
+    rewards[0] += 1
+    beta, rho = _column(beta, n_agents), _column(rho, n_agents)
+    reward = np.tile(rewards, (n_agents, 1))
+    strength = (reward/600.)**rho - .5
+    second, rt, responded = _respond(rng, strength, beta, choice_rule, rt_model, time_limit)
+    trials = {'choice': _keys(second, responded, choice_keys), 'reward': reward, 'rt': rt,
+              'trial': np.tile(np.arange(len(rewards)), (n_agents, 1))}
+    return trials, np.ones(reward.shape, dtype=bool)
+
+def simulate_example_2(n_agents, rng, beta=10., rho=1., choice_rule=softmax_choice, rt_model=None, choice_keys=('a', 'l'),
+                       n_trials=50, value_upper=3000, value_lower=0, min_difference=25):
+    """
+    Titration of the sure amount (left, first key) against a 10% chance of winning 3000 (right): the utility of x is
+    (x/3000)**rho, and the strength for the gamble is its utility (.1) minus the one of the sure amount.
+    The agents that reach min_difference stop, as in the example (their following trials are not valid).
+    """
+    rt_model = LognormalRT() if rt_model is None else rt_model
+    beta, rho = _column(beta, n_agents), _column(rho, n_agents)
+    upper = np.full(n_agents, value_upper)
+    lower = np.full(n_agents, value_lower)
+    active = np.ones(n_agents, dtype=bool)
+    trials = dict((name, np.zeros((n_agents, n_trials), dtype=int)) for name in ['current', 'upper', 'lower', 'difference', 'trial'])
+    trials['choice'] = np.empty((n_agents, n_trials), dtype=object)
+    trials['rt'] = np.zeros((n_agents, n_trials))
+    valid = np.zeros((n_agents, n_trials), dtype=bool)
+
+    for t in range(n_trials):
+        current = np.round((upper + lower)/2.).astype(int)
+        strength = .1 - (current[:, None]/3000.)**rho
+        second, rt, responded = _respond(rng, strength, beta, choice_rule, rt_model) # no time limit
+        second = second[:, 0]
+        for name, values in [('current', current), ('upper', upper), ('lower', lower), ('difference', upper - lower), ('trial', t)]:
+            trials[name][:, t] = values
+        trials['choice'][:, t] = _keys(second, responded[:, 0], choice_keys)
+        trials['rt'][:, t] = rt[:, 0]
+        valid[:, t] = active
+
+        upper = np.where(~second, current, upper) # sure amount chosen
+        lower = np.where(second, current, lower)
+        active &= (upper - lower) >= min_difference
+        if not np.any(active):
+            break
+    return trials, valid
+
+def simulate_example_3(n_agents, rng, beta=1., sensitivity=None, learning_rate=.2, choice_rule=softmax_choice, rt_model=None,
+                       choice_keys=('a', 'b'), time_limit=5, first_participant=1):
+    """
+    Category learning: the strength for the correct category is sensitivity[difficulty], multiplied by
+    1 - exp(-learning_rate*(k + 1)) after k trials of the learning block (the transfer block uses the final value).
+    The trial orders are drawn as in the example (by difficulty in the learning block, counterbalanced
+    between odd and even participants, and shuffled in the transfer block).
+    """
+    rt_model = LognormalRT() if rt_model is None else rt_model
+    sensitivity = {'easy': 3., 'medium': 2., 'hard': 1.} if sensitivity is None else sensitivity
+    n_trials = 30
+    categories = np.repeat(['A', 'B'], 15)
+    correct_responses = np.repeat(choice_keys, 15)
+    difficulties = np.tile(np.repeat(['easy', 'medium', 'hard'], 5), 2)
+    images = np.array(['patch{}.png'.format(n) for n in range(1, 31)])
+
+    participants = np.arange(first_participant, first_participant + n_agents)
+    ranks = counterbalanced_ranks(difficulties, [['easy', 'medium', 'hard'], ['hard', 'medium', 'easy']], participants)
+    learning = shuffled_orders(n_agents, n_trials, group_ranks=ranks, seed=rng.randint(2**31))
+    transfer = shuffled_orders(n_agents, n_trials, seed=rng.randint(2**31))
+    order = np.concatenate([learning, transfer], axis=1)
+
+    beta = _column(beta, n_agents)
+    learned = 1 - np.exp(-learning_rate*np.minimum(np.arange(2*n_trials) + 1, n_trials))
+    strength = np.array([sensitivity[d] for d in difficulties])[order]*learned
+    correct, rt, responded = _respond(rng, strength, beta, choice_rule, rt_model, time_limit)
+    correct_response = correct_responses[order]
+    wrong_response = np.where(correct_response == choice_keys[0], choice_keys[1], choice_keys[0])
+
+    trials = {'accuracy': np.where(responded, correct, np.nan), 'block': np.repeat(['learning', 'transfer'], n_trials)[None, :].repeat(n_agents, 0),
+              'category': categories[order], 'choice': _keys(correct, responded, (wrong_response, correct_response)),
+              'correct_response': correct_response, 'difficulty': difficulties[order], 'image': images[order], 'rt': rt,
+              'trial': np.tile(np.arange(1, n_trials + 1), (n_agents, 2))}
+    return trials, np.ones(order.shape, dtype=bool)
+
+def simulate_example_4(n_agents, rng, beta=.2, alpha=.3, q0=0., full_feedback=False, choice_rule=softmax_choice, rt_model=None,
+                       choice_keys=('q', 'p'), time_limit=3):
+    """
+    Reinforcement learning with pairs of options (the same Q-learning model fitted by rl_fit): the strength for
+    the right option is Q_right - Q_left, and the Q value of the chosen option (of both, with full_feedback=True)
+    is updated as Q = Q + alpha*(feedback - Q).
+    """
+    rt_model = LognormalRT() if rt_model is None else rt_model
+    n_trials = 20
+    beta, alpha = _column(beta, n_agents), _column(alpha, n_agents)
+    means = np.array([36, 40, 50, 54]) # options A, B, C, D
+    rewards = rng.normal(means[:, None, None], 5, size=(4, n_agents, 10)).astype(int)
+
+    # the 20 stimuli of the example, shuffled for every agent
+    left = np.repeat([0, 3], 10) # A, D
+    right = np.tile(np.repeat([1, 2], 5), 2) # B, C
+    f_left = np.concatenate([rewards[0], rewards[3]], axis=1)
+    f_right = np.zeros((n_agents, n_trials), dtype=int)
+    f_right[:, right == 1] = rewards[1]
+    f_right[:, right == 2] = rewards[2]
+    order = np.argsort(rng.uniform(size=(n_agents, n_trials)), axis=1)
+    left, right = left[order], right[order]
+    f_left, f_right = np.take_along_axis(f_left, order, 1), np.take_along_axis(f_right, order, 1)
+
+    q = np.full((n_agents, 4), q0, dtype=float)
+    agents = np.arange(n_agents)
+    second = np.zeros((n_agents, n_trials), dtype=bool)
+    rt = np.zeros((n_agents, n_trials))
+    responded = np.zeros((n_agents, n_trials), dtype=bool)
+    for t in range(n_trials):
+        l, r = left[:, t], right[:, t]
+        strength = (q[agents, r] - q[agents, l])[:, None]
+        s, rt_t, responded_t = _respond(rng, strength, beta, choice_rule, rt_model, time_limit)
+        second[:, t], rt[:, t], responded[:, t] = s[:, 0], rt_t[:, 0], responded_t[:, 0]
+        for option, feedback, chosen in [(r, f_right[:, t], second[:, t] & responded[:, t]), (l, f_left[:, t], ~second[:, t] & responded[:, t])]:
+            update = np.ones(n_agents, dtype=bool) if full_feedback else chosen
+            q[agents, option] += update*alpha[:, 0]*(feedback - q[agents, option])
+
+    names = np.array(['A', 'B', 'C', 'D'])
+    trials = {'choice': _keys(second, responded, choice_keys), 'f_left': f_left, 'f_right': f_right,
+              'i_left': np.char.add(names[left], '.png'), 'i_right': np.char.add(names[right], '.png'), 'rt': rt,
+              'trial': np.tile(np.arange(n_trials), (n_agents, 1)),
+              'trial_type': np.char.add(names[np.minimum(left, right)], names[np.maximum(left, right)])}
+    return trials, np.ones(order.shape, dtype=bool)
+
+DESIGNS = {'example_1': simulate_example_1, 'example_2': simulate_example_2,
+           'example_3': simulate_example_3, 'example_4': simulate_example_4}
+
+def to_frame(trials, valid, expName, participants, constants=None):
+    """
+    Turns the (n_agents, n_trials) arrays of a simulation into a dataframe with one row per valid trial, with the
+    trial columns in alphabetical order followed by the session columns (as the .csv files written by TrialWriter).
+    """
+    constants = dict() if constants is None else constants
+    rows, columns = np.nonzero(valid)
+    frame = pd.DataFrame(dict((name, np.asarray(trials[name])[rows, columns]) for name in sorted(trials)), index=columns)
+    for name in EXP_INFO:
+        if name == 'participant':
+            frame[name] = np.asarray(participants)[rows]
+        elif name == 'expName':
+            frame[name] = expName
+        else:
+            frame[name] = constants.get(name, 'simulated' if name == 'date' else np.nan)
+    return frame
+
+def simulate(design, n_agents, batch_size=10000, seed=None, first_participant=1, constants=None, **parameters):
+    """
+    Simulates n_agents agents doing the task of design (e.g., 'example_4'), batch_size agents at a time, and yields
+    one dataframe per batch (participants are numbered from first_participant). The parameters are passed to
+    the simulate_<design> function, and the ones with one value per agent are split across the batches.
+    """
+    rng = np.random.RandomState(seed)
+    function = DESIGNS[design]
+    for start in range(0, n_agents, batch_size):
+        stop = min(start + batch_size, n_agents)
+        batch_parameters = dict((name, value[start:stop] if np.ndim(value) > 0 and len(value) == n_agents else value)
+                                for name, value in parameters.items())
+        if design == 'example_3':
+            batch_parameters['first_participant'] = first_participant + start # for the counterbalancing
+        trials, valid = function(stop - start, rng, **batch_parameters)
+        yield to_frame(trials, valid, design, np.arange(first_participant + start, first_participant + stop), constants)
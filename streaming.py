@@ -0,0 +1,253 @@
+from collections import deque
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+
+"""
+Streams the trials and the timing events of the sessions running on many stations to a single collector process.
+
+On every station, a StreamClient keeps the records in memory and sends them in batches from a background thread
+running an asyncio event loop, so that the frame loops only append to a queue. As with LogSink, nothing is sent
+while an event is running (unless too many records are waiting). The sends wait for the socket buffer to be
+emptied (back-pressure), and the batches that cannot be sent because the collector is unreachable are written
+to a spool file, and sent when the connection is back. A StreamClient can be given to TrialWriter (stream=),
+to send every row, and to Routine (log_sink=), to send the onsets, offsets and key presses:
+
+    stream = StreamClient(station='station_1', session=os.path.basename(fileName), log_sink=LogSink(fileName + '_events.log'))
+    trial_writer = TrialWriter(fileName + '.csv', constants=expInfo, stream=stream)
+    trial_routine = Routine(window=mywin, frames_per_second=frames_per_second, escape_key=escape_key, log_sink=stream)
+    ...
+    stream.close()
+
+The Collector receives the batches of all the stations and appends them, as they arrive, to trials.jsonl
+(one trial per line, with station and session) and events.csv (station, session, time, level, message) in its store,
+showing the number of records received per second and the lag (time from the creation of the last record to its arrival)
+of every station. It is started from the command line:
+
+    python streaming.py --store collected --port 8765
+"""
+
+DEFAULT_PORT = 8765
+LEVELS = {50: 'CRITICAL', 40: 'ERROR', 30: 'WARNING', 25: 'DATA', 22: 'EXP', 20: 'INFO', 10: 'DEBUG'} # as in psychopy.logging
+
+def _json_default(value):
+    # numpy scalars (e.g., np.float64 in the trial rows)
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+class StreamClient(object):
+    def __init__(self, station, session=None, host='127.0.0.1', port=DEFAULT_PORT, spool_file=None, batch_size=256,
+                 send_interval=.1, retry_interval=2., max_waiting=2**14, log_sink=None):
+        """
+        station: name of the station, session: name of the session (e.g., the base name of the data files)
+        spool_file: where the batches are kept while the collector is unreachable (default: <station>_spool.jsonl)
+        batch_size: maximum number of records sent in one message
+        send_interval: how often the queue is checked, retry_interval: how often the connection is tried again
+        max_waiting: number of records waiting after which they are sent also while an event is running
+        log_sink: optional LogSink, to which the log messages are also given (so that they are also written to a file)
+        """
+        self.station = station
+        self.session = session
+        self.host = host
+        self.port = port
+        self.spool_file = '%s_spool.jsonl' % station if spool_file is None else spool_file
+        self.batch_size = batch_size
+        self.send_interval = send_interval
+        self.retry_interval = retry_interval
+        self.max_waiting = max_waiting
+        self.log_sink = log_sink
+        self.n_sent = 0
+        self.n_spooled = 0
+        self.connected = False
+        self._busy = False
+        self._queue = deque() # appended by the frame loops, emptied by the event loop thread
+        self._writer = None
+        self._last_attempt = -float('inf')
+        self._running = True
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_until_complete, args=(self._run(),), name='StreamClient')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def busy(self):
+        return self._busy
+
+    @busy.setter
+    def busy(self, value):
+        # set by the Routine while an event is running
+        self._busy = value
+        if self.log_sink is not None:
+            self.log_sink.busy = value
+
+    def send(self, kind, record):
+        """Queues a record ('trial' or 'event'), without any formatting or network access."""
+        self._queue.append((kind, time.time(), record))
+
+    def write(self, t, level, msg, *values):
+        """Same as LogSink.write, so that the StreamClient can be the log_sink of a Routine (formatted when sent)."""
+        if values:
+            values = tuple(float('nan') if value is None else value for value in values) # as in LogSink.write
+        self.send('event', (t, level, msg, values))
+        if self.log_sink is not None:
+            self.log_sink.write(t, level, msg, *values)
+
+    def _batches(self):
+        # the queued records, grouped by kind, as encoded messages
+        records = {'trial': [], 'event': []}
+        created = {'trial': 0., 'event': 0.}
+        for i in range(len(self._queue)):
+            kind, t, record = self._queue.popleft()
+            if kind == 'event':
+                event_time, level, msg, values = record
+                if values:
+                    try:
+                        msg = msg % values
+                    except (TypeError, ValueError): # a bad record should not stop the thread (and all the records after it)
+                        msg = '%s %s' % (msg, values)
+                record = (event_time, level, msg)
+            records[kind].append(record)
+            created[kind] = t
+        lines = []
+        for kind in ['trial', 'event']:
+            for start in range(0, len(records[kind]), self.batch_size):
+                batch = {'station': self.station, 'session': self.session, 'kind': kind,
+                         'created': created[kind], 'records': records[kind][start:start + self.batch_size]}
+                lines.append((json.dumps(batch, default=_json_default) + '\n').encode())
+        return lines
+
+    async def _connect(self):
+        self._last_attempt = time.time()
+        try:
+            reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self._writer = None
+            return False
+        self.connected = True
+        if os.path.exists(self.spool_file): # what could not be sent before
+            with open(self.spool_file, 'rb') as f:
+                spooled = f.readlines()
+            if await self._send(spooled, spool=False):
+                os.remove(self.spool_file)
+        return self.connected
+
+    async def _send(self, lines, spool=True):
+        if self._writer is not None:
+            try:
+                for line in lines:
+                    self._writer.write(line)
+                    await self._writer.drain() # wait if the collector is slower than the station
+                self.n_sent += len(lines)
+                return True
+            except (OSError, ConnectionError):
+                self._writer = None
+                self.connected = False
+        if spool:
+            with open(self.spool_file, 'ab') as f:
+                f.writelines(lines)
+            self.n_spooled += len(lines)
+        return False
+
+    async def _run(self):
+        while self._running or len(self._queue) > 0:
+            if self._running:
+                await asyncio.sleep(self.send_interval)
+            if self._writer is None and time.time() - self._last_attempt > self.retry_interval:
+                await self._connect()
+            if len(self._queue) > 0 and (not self._busy or len(self._queue) > self.max_waiting or not self._running):
+                await self._send(self._batches())
+        if self._writer is not None:
+            self._writer.close()
+
+    def close(self):
+        if not self._running:
+            return
+        self._running = False # the thread sends (or spools) what is left and stops
+        self._thread.join()
+        self._loop.close()
+        if self.log_sink is not None:
+            self.log_sink.close()
+
+class Collector(object):
+    def __init__(self, store='collected', display_interval=2.):
+        self.store = store
+        self.display_interval = display_interval
+        self.stations = dict() # (station, session) -> dict of counters
+        if not os.path.exists(store):
+            os.makedirs(store)
+        self._trials = open(os.path.join(store, 'trials.jsonl'), 'a')
+        self._events = open(os.path.join(store, 'events.csv'), 'a')
+        if self._events.tell() == 0:
+            self._events.write('station,session,time,level,message\n')
+
+    async def _handle(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            self._merge(json.loads(line.decode()), time.time())
+        writer.close()
+
+    def _merge(self, batch, arrival):
+        station, session = batch['station'], batch['session']
+        if batch['kind'] == 'trial':
+            self._trials.writelines([json.dumps(dict(record, station=station, session=session)) + '\n' for record in batch['records']])
+            self._trials.flush()
+        else:
+            self._events.writelines(['%s,%s,%.4f,%s,"%s"\n' % (station, session, t, LEVELS.get(level, level), msg.replace('"', '""'))
+                                     for t, level, msg in batch['records']])
+            self._events.flush()
+        counters = self.stations.setdefault((station, session), {'records': 0, 'last_records': 0, 'lag': 0.})
+        counters['records'] += len(batch['records'])
+        counters['lag'] = arrival - batch['created']
+
+    async def _display(self):
+        while True:
+            await asyncio.sleep(self.display_interval)
+            print('%-20s %-40s %10s %10s %10s' % ('station', 'session', 'records', 'per s', 'lag (ms)'))
+            for (station, session), counters in sorted(self.stations.items(), key=lambda item: str(item[0])):
+                rate = (counters['records'] - counters['last_records'])/self.display_interval
+                counters['last_records'] = counters['records']
+                print('%-20s %-40s %10d %10.1f %10.1f' % (station, session, counters['records'], rate, 1000*counters['lag']))
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        server = await asyncio.start_server(self._handle, host, port)
+        display = asyncio.ensure_future(self._display())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            display.cancel()
+            self.close()
+
+    def close(self):
+        self._trials.close()
+        self._events.close()
+
+def load_trials(store='collected'):
+    """Returns the trials collected from all the stations as a dataframe."""
+    import pandas as pd
+    return pd.read_json(os.path.join(store, 'trials.jsonl'), lines=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Collects the trials and events streamed by the stations.')
+    parser.add_argument('--store', default='collected')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--display-interval', type=float, default=2.)
+    args = parser.parse_args()
+
+    collector = Collector(args.store, display_interval=args.display_interval)
+    try:
+        asyncio.run(collector.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_routine import AsyncRoutine
+from headless import HeadlessEvents, HeadlessWindow, ScriptedResponder
+
+def _routine(responses):
+    window = HeadlessWindow(frames_per_second=60)
+    return AsyncRoutine(window=window, frames_per_second=60, escape_key='escape', timer=window.getClock(),
+                        events=HeadlessEvents(window, ScriptedResponder(responses)))
+
+def _count_steps(routine, event):
+    # number of steps that a background task could do while the event runs
+    steps = [0]
+
+    async def count():
+        while True:
+            steps[0] += 1
+            await asyncio.sleep(0)
+
+    async def session():
+        task = routine.background(count(), name='count')
+        result = await event()
+        n_steps = steps[0]
+        task.cancel()
+        return result, n_steps
+
+    return asyncio.run(session())
+
+def test_background_steps_during_wait_for_keys():
+    routine = _routine([('q', .2)])
+    (key, rt), n_steps = _count_steps(routine, lambda: routine.wait_for_keys([], ['q', 'p'], 'choice'))
+    assert key == 'q'
+    assert abs(rt - .2) < 1e-6
+    assert n_steps > 10 # the background task ran between the flips, not only before and after the event
+
+def test_background_steps_during_wait_for_time_limit():
+    routine = _routine([])
+    time_seconds, n_steps = _count_steps(routine, lambda: routine.wait_for_time_limit([], .2, 'fixation'))
+    assert time_seconds == .2
+    assert n_steps > 10
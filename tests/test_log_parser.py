@@ -0,0 +1,31 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_parser import audit, event_durations, read_logs
+
+LOG = """1.0000 \tEXP \tfixation_cross onset
+2.0100 \tEXP \tfixation_cross offset
+2.0100 \tEXP \tchoice onset
+2.5000 \tDATA \tKeypress: q
+2.5167 \tEXP \tchoice offset
+2.5167 \tEXP \tchoice onset
+4.5167 \tEXP \tchoice offset
+"""
+
+def test_response_terminated_events(tmp_path):
+    file_name = str(tmp_path / 'example_3_1_2024.log')
+    with open(file_name, 'w') as f:
+        f.write(LOG)
+    logs = read_logs([file_name])
+    durations = event_durations(logs, requested={'fixation_cross': 1, 'choice': 2})
+    assert list(durations['label']) == ['fixation_cross', 'choice', 'choice']
+    assert list(durations['response']) == [False, True, False]
+
+    result = audit(logs, requested={'fixation_cross': 1, 'choice': 2}, by_session=False)
+    assert result.loc['choice', 'count'] == 1 and result.loc['choice', 'responses'] == 1
+    assert np.isclose(result.loc['choice', 'mean'], 0.) # the event ended by the response is left out
+    assert np.isclose(result.loc['fixation_cross', 'mean'], .01)
@@ -0,0 +1,130 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from headless import HeadlessEvents, HeadlessMouse, HeadlessWindow, ScriptedResponder, headless_routine
+from routines import FrameRecorder, Routine
+
+class _DroppingWindow(HeadlessWindow):
+    """HeadlessWindow that misses the refresh (one frame later) at the flips with the given numbers (from 1)."""
+    def __init__(self, frames_per_second, dropped):
+        HeadlessWindow.__init__(self, frames_per_second)
+        self.dropped = set(dropped)
+
+    def flip(self, clearBuffer=True):
+        if self.frame_count + 1 in self.dropped:
+            self.time += self.frame_period
+        return HeadlessWindow.flip(self, clearBuffer)
+
+class _KeySequence(object):
+    """Same getKeys/getReleases/clearEvents functions as HeadlessEvents, with several (key, down, up) presses per event (times from the onset)."""
+    def __init__(self, window, presses):
+        self.window = window
+        self.presses = presses
+        self._onset = None
+        self._pressed = set()
+        self._released = set()
+
+    def clearEvents(self, eventType=None):
+        self._onset = None
+        self._pressed.clear()
+        self._released.clear()
+
+    def _new(self, done, column, key_list, clock):
+        if self._onset is None: # the first read is after the first flip of the event
+            self._onset = self.window.time
+        keys = []
+        for i, press in enumerate(self.presses):
+            if i not in done and self._onset + press[column] <= self.window.time and (key_list is None or press[0] in key_list):
+                done.add(i)
+                keys.append((press[0], self._onset + press[column] - clock.getLastResetTime()))
+        return keys
+
+    def getKeys(self, keyList=None, timeStamped=False):
+        return self._new(self._pressed, 1, keyList, timeStamped)
+
+    def getReleases(self, keyList=None, timeStamped=False):
+        return self._new(self._released, 2, keyList, timeStamped)
+
+def _routine(window, responses=(), **kwargs):
+    return Routine(window=window, frames_per_second=60, escape_key='escape', timer=window.getClock(),
+                   events=HeadlessEvents(window, ScriptedResponder(responses)), **kwargs)
+
+def test_frame_recorder_with_wait_for_keys():
+    # the requested number of frames is None for the events without time limit
+    routine = headless_routine(60, 'escape', ScriptedResponder([('q', .205)]), frame_recorder=FrameRecorder(60))
+    key, rt = routine.wait_for_keys([], ['q', 'p'], 'choice')
+    assert key == 'q'
+    stats = routine.frame_recorder.get_events('choice')[0]
+    assert stats['n_frames_requested'] is None
+    assert stats['n_frames'] == 14 # the onset and 13 frames until the key press (.217 s)
+
+def test_frame_recorder_dropped_frames():
+    routine = _routine(_DroppingWindow(60, dropped=[10, 20]), frame_recorder=FrameRecorder(60))
+    routine.wait_for_time_limit([], .5, 'fixation')
+    stats = routine.frame_recorder.get_events('fixation')[0]
+    assert stats['n_frames'] == 30 and stats['n_frames_requested'] == 30
+    assert stats['dropped_frames'] == 2
+    assert np.isclose(stats['interval_max'], 2/60.) and np.isclose(stats['interval_min'], 1/60.)
+    assert np.isclose(stats['duration'], 32/60.) # 30 frames and the 2 missed refreshes
+    assert len(routine.frame_recorder.get_flip_times('fixation')[0]) == 30
+
+def test_deadline_drift_carry_over():
+    # the last flip of the first event misses the refresh: the second event is one frame shorter to end on time
+    routine = _routine(_DroppingWindow(60, dropped=[30]), frame_recorder=FrameRecorder(60), deadline_timing=True)
+    routine.wait_for_time_limit([], .5, 'first')
+    routine.wait_for_time_limit([], .5, 'second')
+    (first_label, first_drift), (second_label, second_drift) = routine.drifts
+    assert (first_label, second_label) == ('first', 'second')
+    assert np.isclose(first_drift, 1/60.) and np.isclose(second_drift, 0.)
+    n_frames = [stats['n_frames'] for stats in routine.frame_recorder.get_events()]
+    assert n_frames == [30, 29]
+    flip_times = routine.frame_recorder.get_flip_times()
+    assert np.isclose(flip_times[-1] + 1/60. - flip_times[0], 1.) # both events together last their 1 s
+
+def test_deadline_after_response():
+    # an event ended by a response does not drift: the next deadlines start from its end
+    routine = _routine(HeadlessWindow(60), responses=[('q', .1)], deadline_timing=True)
+    routine.wait_for_keys_or_time_limit([], ['q'], 1., 'choice')
+    routine.wait_for_time_limit([], .5, 'feedback')
+    assert len(routine.drifts) == 1 and np.isclose(routine.drifts[0][1], 0.)
+
+def test_record_keys_press_and_release():
+    routine = _routine(HeadlessWindow(60), responses=[('q', .2)])
+    key, rt, presses = routine.wait_for_time_limit_first_key([], ['q', 'p'], .5, 'choice', record_keys=True)
+    assert key == 'q' and np.isclose(rt, .2)
+    assert len(presses) == 1 and presses['key'][0] == 'q'
+    assert np.isclose(presses['down'][0], .2) and np.isclose(presses['up'][0], .3) # held for .1 s
+
+def test_first_key_kept():
+    # the first response is returned, also if other keys are pressed later; all of them are recorded
+    window = HeadlessWindow(60)
+    presses = [('p', .1, .15), ('q', .2, .45), ('p', .3, .6)]
+    routine = Routine(window=window, frames_per_second=60, escape_key='escape', timer=window.getClock(),
+                      events=_KeySequence(window, presses))
+    key, rt, recorded = routine.wait_for_time_limit_first_key([], ['q', 'p'], .5, 'choice', record_keys=True)
+    assert key == 'p' and np.isclose(rt, .1)
+    assert list(recorded['key']) == ['p', 'q', 'p']
+    assert np.allclose(recorded['down'], [.1, .2, .3])
+    assert np.allclose(recorded['up'][:2], [.15, .45]) and np.isnan(recorded['up'][2]) # released after the end of the event
+
+def test_wait_for_region_with_mouse_samples():
+    # the pointer starts moving .1 s after the onset, at 1000 units per second, and is in the region from x=160 at the flip .25 s after the onset
+    window = HeadlessWindow(60)
+    routine = _routine(window, mouse=HeadlessMouse(window, targets=[(200, 0)], delay=.1, speed=1000.))
+    regions = [(-250, -50, -160, 50), (160, -50, 250, 50)]
+    region, rt, samples = routine.wait_for_region([], regions, 'reach', time_seconds=2., start_pos=(0, 0), record_mouse=True)
+    assert region == 1 and np.isclose(rt, .25) # the 16th flip (the onset is at the first one)
+    assert len(samples) == 16
+    assert np.allclose(samples['time'], np.arange(16)/60.)
+    assert np.all(np.diff(samples['x']) >= 0) and np.all(samples['y'] == 0)
+    assert samples['x'][0] == 0 and samples['x'][-1] >= 160
+
+def test_wait_for_region_timeout():
+    window = HeadlessWindow(60)
+    routine = _routine(window, mouse=HeadlessMouse(window, targets=[(200, 0)], delay=.1, speed=1000.))
+    region, rt = routine.wait_for_region([], [(160, -50, 250, 50)], 'reach', time_seconds=.2, start_pos=(0, 0))
+    assert np.isnan(region) and rt == .2
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from headless import ScriptedResponder, headless_routine
+from routines import FrameRecorder
+from timeline import Timeline
+
+def _trial(routine, messages):
+    trial = Timeline(routine)
+    trial.wait_for_time_limit([], .5, 'fixation_cross')
+    trial.wait_for_keys_or_time_limit([], ['a', 'l'], 1., 'choice')
+    trial.wait_for_time_limit(lambda results: messages.append(results['choice'][0]) or [], .2, 'feedback',
+                              condition=lambda results: isinstance(results['choice'][0], str)) # only after a response
+    trial.wait_for_time_limit([], .001, 'too_short') # shorter than half a frame: skipped
+    return trial
+
+def test_timeline_run():
+    routine = headless_routine(60, 'escape', ScriptedResponder([('a', .3), None]), frame_recorder=FrameRecorder(60))
+    messages = []
+    trial = _trial(routine, messages)
+    results = trial.run()
+    assert results['fixation_cross'] == .5 and results['too_short'] == .001
+    assert results['choice'][0] == 'a' and np.isclose(results['choice'][1], .3)
+    assert messages == ['a'] # the components of the feedback are computed with the results of the choice
+    n_frames = [(stats['label'], stats['n_frames']) for stats in routine.frame_recorder.get_events()]
+    assert n_frames == [('fixation_cross', 30), ('choice', 19), ('feedback', 12)]
+
+    results = trial.run() # the same schedule, no response this time
+    assert np.isnan(results['choice'][0]) and results['choice'][1] == 1.
+    assert 'feedback' not in results and messages == ['a']
+
+def test_timeline_refresh_change():
+    # the numbers of frames of the schedule follow the refresh rate of the routine
+    routine = headless_routine(60, 'escape', ScriptedResponder([None]), frame_recorder=FrameRecorder(60))
+    trial = _trial(routine, [])
+    assert [ev['n_frames'] for ev in trial.events] == [30, 60, 12, 0]
+    routine.frames_per_second = 120. # as measure_refresh would set it on a 120 Hz monitor
+    trial.run()
+    assert [ev['n_frames'] for ev in trial.events] == [60, 120, 24, 0]
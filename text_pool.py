@@ -0,0 +1,43 @@
+from psychopy.visual import TextStim
+
+"""
+Creates in advance one TextStim for each of the texts that can be shown during the experiment,
+so that changing the text in a trial does not require to lay out the glyphs again
+(which can take longer than a frame), but only to pick another stimulus.
+"""
+
+class TextPool(object):
+    def __init__(self, window, texts, prepare=True, **kwargs):
+        """
+        window: the window where the texts are drawn
+        texts: all the texts that can be shown
+        prepare: if True, every stimulus is drawn once (offscreen) when the pool is created
+        the other arguments (color, pos, height, ...) are passed to every TextStim
+        """
+        self.window = window
+        self.texts = list(texts)
+        self.stims = [TextStim(win=window, text=text, **kwargs) for text in self.texts]
+        self._index = dict()
+        for i, text in enumerate(self.texts):
+            self._index.setdefault(text, i)
+        if prepare:
+            self.prepare()
+
+    def prepare(self):
+        """Draws every stimulus in the back buffer and then clears it, so that nothing is left to do at the first real draw."""
+        for stim in self.stims:
+            stim.draw()
+        self.window.clearBuffer()
+
+    def __len__(self):
+        return len(self.stims)
+
+    def __getitem__(self, index):
+        return self.stims[index]
+
+    def index(self, text):
+        return self._index[text]
+
+    def get(self, text):
+        """Returns the stimulus showing a certain text (which must be one of the texts given when the pool was created)."""
+        return self.stims[self._index[text]]
@@ -0,0 +1,135 @@
+from psychopy import core
+import numpy as np
+
+"""
+Runs a whole trial (or block) as a single loop over the monitor frames, instead of one Routine call per event.
+The events are added with the same methods (and arguments) of the Routine class, and their schedule is built
+when they are added (components composed, valid keys, number of frames, results on timeout), so that when an event ends,
+the next one starts at the next flip. If the refresh rate of the routine changes afterwards (e.g., measure_refresh),
+the numbers of frames are computed again when the timeline runs. Events shorter than half a frame are skipped,
+as in the Routine methods. The loop uses the public hooks of the routine (start_event, flip, event_expired,
+log_keypress, end_event).
+
+Components can also be a function, which is called when the event starts with the results of the previous events
+and returns the list of components (e.g., a feedback message that depends on the response),
+and condition can be a function with the same argument, which returns False if the event should be skipped.
+
+The run method returns a dictionary with, for each label, the same values returned by the Routine methods.
+"""
+
+class Timeline(object):
+    def __init__(self, routine):
+        self.routine = routine
+        self.events = []
+        self.frames_per_second = routine.frames_per_second # refresh rate of the numbers of frames in the schedule
+
+    def _n_frames(self, time_seconds):
+        # number of frames of an event (-1: until a key is pressed)
+        if time_seconds is None:
+            return -1
+        return int(np.round(self.frames_per_second*time_seconds))
+
+    def _add(self, kind, components, label, valid_keys=None, time_seconds=None, condition=None):
+        if label in [ev['label'] for ev in self.events]:
+            raise ValueError('There is already an event with label %s' % label)
+        if valid_keys is None:
+            key_list = [self.routine.escape_key]
+        else:
+            key_list = list(np.append(valid_keys, self.routine.escape_key))
+        self.events.append({'kind': kind, 'label': label, 'key_list': key_list, 'time_seconds': time_seconds, 'condition': condition,
+                            # the components given as a function depend on the results, and are only composed when the event starts
+                            'components': components if callable(components) else self.routine.compose(components),
+                            'n_frames': self._n_frames(time_seconds),
+                            'stop_on_key': kind in ('keys', 'keys_or_time_limit'),
+                            'timeout': time_seconds if kind == 'time_limit' else (np.nan, time_seconds)})
+
+    def wait_for_time_limit(self, components, time_seconds, label, condition=None):
+        self._add('time_limit', components, label, time_seconds=time_seconds, condition=condition)
+
+    def wait_for_keys(self, components, valid_keys, label, condition=None):
+        self._add('keys', components, label, valid_keys=valid_keys, condition=condition)
+
+    def wait_for_keys_or_time_limit(self, components, valid_keys, time_seconds, label, condition=None):
+        self._add('keys_or_time_limit', components, label, valid_keys=valid_keys, time_seconds=time_seconds, condition=condition)
+
+    def wait_for_time_limit_first_key(self, components, valid_keys, time_seconds, label, condition=None):
+        self._add('time_limit_first_key', components, label, valid_keys=valid_keys, time_seconds=time_seconds, condition=condition)
+
+    def _update_frames(self):
+        # the numbers of frames of the schedule, with the current refresh rate of the routine
+        if self.frames_per_second != self.routine.frames_per_second:
+            self.frames_per_second = self.routine.frames_per_second
+            for ev in self.events:
+                ev['n_frames'] = self._n_frames(ev['time_seconds'])
+
+    def _next_event(self, index, results):
+        # index of the next event to run (skipping those whose condition is False), or None at the end
+        index += 1
+        while index < len(self.events):
+            ev = self.events[index]
+            if ev['condition'] is None or ev['condition'](results):
+                if ev['n_frames'] != 0:
+                    return index
+                results[ev['label']] = ev['timeout'] # shorter than half a frame: not shown, as in the Routine methods
+            index += 1
+        return None
+
+    def _start(self, ev, results):
+        # starts the event at the next flip, and returns its components
+        components = ev['components']
+        if callable(components):
+            components = self.routine.compose(components(results))
+        self.routine.start_event(ev['label'], None if ev['n_frames'] < 0 else ev['n_frames'], ev['time_seconds'])
+        return components
+
+    def run(self):
+        routine = self.routine
+        window = routine.window
+        events = routine.events
+        timer = routine.timer
+        escape_key = routine.escape_key
+        results = dict()
+        self._update_frames()
+
+        index = self._next_event(-1, results)
+        if index is None:
+            return results
+        ev = self.events[index]
+        components = self._start(ev, results)
+        response = None
+        frameN = 0
+
+        while True:
+            for comp in components:
+                comp.draw()
+            flip_time = routine.flip()
+            frameN += 1
+
+            pressed_keys = events.getKeys(keyList=ev['key_list'], timeStamped=timer)
+            if len(pressed_keys)>0:
+                key, rt = pressed_keys[0] # get the first pressed key and response time
+                routine.log_keypress(key)
+
+                if key == escape_key:
+                    window.close()
+                    core.quit()
+                elif response is None:
+                    response = (key, rt)
+
+            if (ev['n_frames'] > 0 and frameN >= ev['n_frames']) or routine.event_expired(flip_time) or (ev['stop_on_key'] and response is not None):
+                # the event ends: store its results and start the next one, at the next flip
+                if ev['kind'] == 'time_limit' or response is None:
+                    results[ev['label']] = ev['timeout']
+                else:
+                    results[ev['label']] = response
+                routine.end_event(ev['label'], timed=not (ev['stop_on_key'] and response is not None))
+
+                index = self._next_event(index, results)
+                if index is None:
+                    break
+                ev = self.events[index]
+                components = self._start(ev, results)
+                response = None
+                frameN = 0
+
+        return results
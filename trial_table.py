@@ -0,0 +1,115 @@
+import numpy as np
+
+"""
+Keeps the trials of a session in memory in a structured numpy array with typed columns, allocated once for the
+expected number of trials (and doubled only if more trials are added), instead of a growing list or dataframe.
+While the trials are added, it keeps the count, mean and variance of some columns (e.g., accuracy and rt) for
+the whole session and for groups of trials (e.g., per block, or per block and difficulty), updated with each trial
+(Welford's algorithm), so that they can be used during the session (feedback, adaptive procedures) without
+going through all the trials again. Missing values (nan) are not counted, as in np.nanmean.
+
+    trial_table = TrialTable(n_trials=60, columns=[('block', 'U8'), ('difficulty', 'U8'), ('accuracy', 'f8'), ('rt', 'f8')],
+                             aggregate=['accuracy', 'rt'], group_by=['block', ('block', 'difficulty')])
+    trial_table.append({'block': 'learning', 'difficulty': 'easy', 'accuracy': 1, 'rt': .6})
+    trial_table.mean('accuracy', block='learning')
+    data = trial_table.to_frame() # at the end of the session
+"""
+
+class TrialTable(object):
+    def __init__(self, n_trials, columns, aggregate=(), group_by=()):
+        """
+        n_trials: expected number of trials (rows are preallocated)
+        columns: list of (name, numpy dtype) pairs, e.g. ('rt', 'f8'), ('choice', 'U8')
+        aggregate: columns for which the count, mean and variance are kept
+        group_by: columns (or tuples of columns) defining the groups for which the aggregates are also kept
+        """
+        self.dtype = np.dtype(list(columns))
+        self.data = self._empty(n_trials)
+        self.n_rows = 0
+        self.aggregate = list(aggregate)
+        self.group_by = [()] + [(g,) if isinstance(g, str) else tuple(g) for g in group_by] # () is the whole session
+        self._stats = dict((grouping, dict()) for grouping in self.group_by) # grouping -> group -> [[count, mean, m2], ...]
+
+    def _empty(self, n_rows):
+        data = np.zeros(n_rows, dtype=self.dtype)
+        for name in self.dtype.names:
+            if self.dtype[name].kind == 'f':
+                data[name] = np.nan
+        return data
+
+    def append(self, row):
+        """Adds a trial (a dictionary with column names as keys; columns not given are left missing)."""
+        if self.n_rows == len(self.data):
+            self.data = np.concatenate([self.data, self._empty(max(len(self.data), 1))])
+        i = self.n_rows
+        for name, value in row.items():
+            if self.dtype[name].kind == 'U' and (value is None or isinstance(value, float) and np.isnan(value)):
+                value = '' # missing response
+            self.data[name][i] = value
+        self.n_rows += 1
+
+        values = [row.get(column) for column in self.aggregate]
+        for grouping, groups in self._stats.items():
+            group = tuple(row.get(name) for name in grouping)
+            stats = groups.get(group)
+            if stats is None:
+                stats = groups[group] = [[0, 0., 0.] for column in self.aggregate]
+            for x, s in zip(values, stats):
+                if x is None or x != x: # missing (nan)
+                    continue
+                s[0] += 1
+                delta = x - s[1]
+                s[1] += delta/s[0]
+                s[2] += delta*(x - s[1])
+
+    def __len__(self):
+        return self.n_rows
+
+    def _get(self, column, group):
+        grouping = tuple(sorted(group))
+        for g in self.group_by:
+            if tuple(sorted(g)) == grouping:
+                stats = self._stats[g].get(tuple(group[name] for name in g))
+                if stats is None:
+                    return [0, np.nan, np.nan]
+                return stats[self.aggregate.index(column)]
+        raise ValueError('The aggregates are not kept for groups of %s' % ', '.join(grouping))
+
+    def count(self, column, **group):
+        """Number of (non missing) values of column, in the whole session or in a group (e.g., block='learning')."""
+        return self._get(column, group)[0]
+
+    def mean(self, column, **group):
+        count, mean, m2 = self._get(column, group)
+        return mean if count > 0 else np.nan
+
+    def var(self, column, ddof=1, **group):
+        count, mean, m2 = self._get(column, group)
+        return m2/(count - ddof) if count > ddof else np.nan
+
+    def sd(self, column, ddof=1, **group):
+        return np.sqrt(self.var(column, ddof, **group))
+
+    def aggregates(self, group_by=()):
+        """Returns a dataframe with the count, mean and sd of every aggregated column, for the groups of group_by."""
+        import pandas as pd
+        grouping = (group_by,) if isinstance(group_by, str) else tuple(group_by)
+        rows = []
+        for group in self._stats[grouping]:
+            row = dict(zip(grouping, group))
+            for column in self.aggregate:
+                stats = dict(zip(grouping, group))
+                row[column + '_count'] = self.count(column, **stats)
+                row[column + '_mean'] = self.mean(column, **stats)
+                row[column + '_sd'] = self.sd(column, **stats)
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def to_frame(self):
+        """Returns the trials as a dataframe (one row per trial), with missing values as nan (as read from the .csv files)."""
+        import pandas as pd
+        frame = pd.DataFrame(self.data[:self.n_rows])
+        for name in self.dtype.names:
+            if self.dtype[name].kind == 'U':
+                frame[name] = frame[name].where(frame[name] != '', np.nan)
+        return frame
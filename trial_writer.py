@@ -0,0 +1,78 @@
+import atexit
+import csv
+import os
+import numpy as np
+
+"""
+Writes the data of an experiment one trial at a time, instead of saving the whole dataframe after every trial.
+Every row is appended to the .csv file, so the cost of saving a trial does not grow with the number of trials.
+The file has the same format as the one written by pandas (index column, then trial columns, then session columns).
+"""
+
+class TrialWriter(object):
+    def __init__(self, file_name, constants=None, columns=None, flush_every=1, fsync=False, stream=None):
+        """
+        file_name: path of the .csv file
+        constants: dictionary with the session information (e.g., expInfo), written in every row
+        columns: order of the trial columns (if None, the sorted keys of the first row)
+        flush_every: number of trials after which the buffer is written to the file
+        fsync: if True, the file is also synced to disk after every flush (safer against crashes but slower)
+        stream: optional StreamClient, to which every row (with the session information) is also sent
+        """
+        self.file_name = file_name
+        self.constants = dict() if constants is None else dict(constants)
+        self.columns = None if columns is None else list(columns)
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.stream = stream
+        self.n_rows = 0
+
+        # format the session information only once
+        self._constant_labels = list(self.constants.keys())
+        self._constant_values = [self._format(self.constants[label]) for label in self._constant_labels]
+
+        self._file = open(file_name, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        atexit.register(self.close) # flush what is left also when the experiment is quit with the escape key
+
+    @staticmethod
+    def _format(value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return '' # as pandas does for missing values
+        return value
+
+    def write(self, row):
+        """Appends one trial (a dictionary with column names as keys) to the file."""
+        if self.columns is None:
+            self.columns = sorted(row.keys())
+        if self.n_rows == 0:
+            self._writer.writerow([''] + self.columns + self._constant_labels)
+
+        unknown = set(row.keys()) - set(self.columns)
+        if len(unknown) > 0:
+            raise ValueError('Unknown columns: %s' % ', '.join(sorted(unknown)))
+
+        self._writer.writerow([self.n_rows] + [self._format(row.get(col)) for col in self.columns] + self._constant_values)
+        if self.stream is not None:
+            record = dict(self.constants)
+            record.update(row)
+            self.stream.send('trial', record)
+        self.n_rows += 1
+        if self.n_rows % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()